@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import time
+
+import config
+import db
+from cache import LookupCache
+import negindex
+from passes import MosPass
+from records import PassRecord
+from retry import CircuitOpenError
+from proxies import ProxyPool
+
+LOGGER = logging.getLogger(__name__)
+
+
+class RateBudget:
+    """Токен-бакет: в среднем rate запросов в секунду, не больше burst подряд."""
+
+    def __init__(self, rate: float | None, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait_time(self) -> float:
+        """Через сколько секунд будет доступен следующий запрос (0 - уже доступен)."""
+        if not self.rate:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        if self.rate:
+            self.tokens -= 1
+
+
+class Account:
+    def __init__(self, mospass: MosPass, budget: RateBudget):
+        self.mospass = mospass
+        self.budget = budget
+        self.in_flight = 0
+
+    @property
+    def username(self):
+        return self.mospass.username
+
+    @property
+    def breaker(self):
+        return self.mospass.breakers['account']
+
+    @property
+    def available(self) -> bool:
+        # Аккаунт на переавторизации или с разомкнутой цепью выводится из ротации
+        return not self.mospass.authenticating and not self.breaker.is_open
+
+
+class AccountPool:
+    """
+    Все активные аккаунты из passes.accounts, у каждого своя сессия MosPass и свой
+    лимит запросов. Запросы раздаются по кругу или наименее загруженному аккаунту
+    (config.ACCOUNTS.strategy).
+    """
+
+    def __init__(self, strategy: str | None = None):
+        self.strategy = strategy or config.ACCOUNTS.strategy
+        self.accounts = []
+        self._next = 0
+        # Общий для всех аккаунтов пул прокси (config.PROXY.enabled)
+        self.proxies = None
+        # Результаты поиска по номерам, общие для всех аккаунтов (config.CACHE)
+        self.cache = LookupCache(config.CACHE.size, config.CACHE.hit_ttl,
+                                 config.CACHE.miss_ttl) if config.CACHE.enabled else None
+
+    def __len__(self):
+        return len(self.accounts)
+
+    async def load(self, usernames=None):
+        """usernames - загрузить только эти аккаунты (своя часть у каждого воркера main.py)."""
+        if config.PROXY.enabled and self.proxies is None:
+            self.proxies = await ProxyPool().load()
+        for row in await db.get_account():
+            if not row['active'] or (usernames is not None and row['login'] not in usernames):
+                continue
+            mospass = MosPass(row['login'], row['password'], row['cookie_value'], self.proxies)
+            budget = RateBudget(config.ACCOUNTS.rate, config.ACCOUNTS.burst)
+            self.accounts.append(Account(mospass, budget))
+        if not self.accounts:
+            raise RuntimeError('В passes.accounts нет активных аккаунтов')
+        LOGGER.info(f"Загружено аккаунтов: {len(self.accounts)}")
+        return self
+
+    def _pick(self, ready: list) -> Account:
+        if self.strategy == 'round_robin':
+            return ready[0]
+        # При равной загрузке min берёт первый, а список уже повёрнут - получается круг
+        return min(ready, key=lambda account: account.in_flight)
+
+    async def acquire(self, exclude=()) -> Account:
+        while True:
+            # Поворачиваем список, чтобы при равенстве аккаунты чередовались
+            rotated = self.accounts[self._next:] + self.accounts[:self._next]
+            rotated = [account for account in rotated if account not in exclude]
+            if not any(account.mospass.authenticating for account in rotated):
+                broken = [account for account in rotated if account.breaker.is_open]
+                if len(broken) == len(rotated):
+                    # Ждать некого: пусть вызывающий вернёт работу в очередь
+                    retry_in = min((account.breaker.retry_in() for account in broken), default=config.RETRY.reset_timeout)
+                    raise CircuitOpenError('accounts', retry_in)
+            candidates = [account for account in rotated if account.available]
+            if candidates:
+                waits = [account.budget.wait_time() for account in candidates]
+                ready = [account for account, wait in zip(candidates, waits) if wait == 0]
+                if ready:
+                    account = self._pick(ready)
+                    self._next = (self.accounts.index(account) + 1) % len(self.accounts)
+                    account.budget.take()
+                    account.in_flight += 1
+                    return account
+                delay = min(waits)
+            else:
+                delay = config.ACCOUNTS.idle_wait
+            await asyncio.sleep(delay)
+
+    def release(self, account: Account):
+        account.in_flight -= 1
+
+    async def get_pass_info(self, pass_no: str, refresh: bool = False) -> PassRecord | None:
+        """
+        Сначала кэш (повторы номера и одновременные запросы одного номера обходятся
+        одним запросом к API); refresh=True - запросить API в любом случае.
+        """
+        if self.cache is None:
+            return await self._get_pass_info(pass_no)
+        # Ключ - номер в том виде, в каком он уходит в API
+        return await self.cache.get(pass_no.replace(' ', ''), lambda: self._get_pass_info(pass_no), refresh)
+
+    async def _get_pass_info(self, pass_no: str) -> PassRecord | None:
+        tried = set()
+        while True:
+            account = await self.acquire(tried)
+            try:
+                result = await account.mospass.get_pass_info(pass_no)
+                # None - только ответ 404/400: на любой другой статус MosPass выбрасывает
+                # исключение, и индекс несуществующих номеров не трогается
+                negindex.record(pass_no, result is not None)
+                return result
+            except CircuitOpenError as e:
+                # Разомкнута цепь аккаунта - пробуем другой; цепь API - дальше не пробуем
+                if e.name != account.breaker.name:
+                    raise
+                tried.add(account)
+            finally:
+                self.release(account)
+
+    @property
+    def total_passed(self) -> int:
+        return sum(account.mospass.total_passed for account in self.accounts)
+
+    async def close(self):
+        for account in self.accounts:
+            await account.mospass.close()
+        if self.proxies is not None:
+            await self.proxies.close()
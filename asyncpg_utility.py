@@ -28,10 +28,12 @@
 
 import sys
 import errno
+import os
 import re
 
 import asyncio
 import asyncpg
+import asyncpg.pool
 
 from unittest import TestCase
 
@@ -40,14 +42,60 @@ from unittest import TestCase
 def run_until_complete(promise):
     return asyncio.get_event_loop().run_until_complete(promise)
 
-async def allocate_pool(host, database, user, pw):
-          return await asyncpg.create_pool(host=host,
+async def allocate_pool(host=None, database=None, user=None, pw=None,
+                        dsn=None, min_size=10, max_size=10,
+                        statement_cache_size=0, **pool_arguments):
+          # Extra keyword arguments (command_timeout, max_inactive_connection_lifetime,
+          # setup, init...) are passed straight through to asyncpg.create_pool.
+          #
+          # statement_cache_size=0 (the default) sends every query as unnamed,
+          # unprepared SQL - the MagicStack bug workaround, and what pgbouncer-style
+          # poolers in transaction/statement mode require.  With a positive size each
+          # pooled connection prepares a query text the first time it sees it and
+          # reuses the server-side statement on every later checkout; the cache lives
+          # and dies with the connection, and on InvalidCachedStatementError (ALTER
+          # TABLE, search_path changes...) asyncpg drops the caches of every
+          # connection in the pool and re-prepares.
+          return await asyncpg.create_pool(dsn,
+                                           host=host,
                                            database=database,
                                            user=user,
                                            password=pw,
-                                           statement_cache_size=0 # MagicStack bug workaround...
+                                           min_size=min_size,
+                                           max_size=max_size,
+                                           statement_cache_size=statement_cache_size,
+                                           **pool_arguments
                                           )
 
+# process-wide cache of compiled queries...
+
+_compiled_queries={}
+
+def compile_query(keyword_query, **query_arguments):
+    # NamedParameterQuery for keyword_query, compiled once per process
+    # (query_arguments are passed on to the NamedParameterQuery constructor)
+    key=(keyword_query, repr(sorted(query_arguments.items())))
+    named_parameter_query=_compiled_queries.get(key)
+    if named_parameter_query is None:
+       named_parameter_query=NamedParameterQuery(keyword_query, **query_arguments)
+       _compiled_queries[key]=named_parameter_query
+
+    return named_parameter_query
+
+_loaded_queries={}
+
+def load_query(path, **query_arguments):
+    # compile_query for the contents of an SQL file, read from disk once per process
+    key=(os.path.abspath(path), repr(sorted(query_arguments.items())))
+    named_parameter_query=_loaded_queries.get(key)
+    if named_parameter_query is None:
+       with open(path) as query_file:
+            named_parameter_query=compile_query(query_file.read(), **query_arguments)
+
+       _loaded_queries[key]=named_parameter_query
+
+    return named_parameter_query
+
 # constructor defaults...
 case_sensitive=False
 parameter_markers=['{{', '}}']
@@ -244,7 +292,7 @@ class NamedParameterQuery:
                            self._WHITESPACE+parameter_markers[1]
 
                  if case_sensitive:
-                    flags=None
+                    flags=0
 
                  else:
                        flags=re.IGNORECASE
@@ -261,6 +309,18 @@ class NamedParameterQuery:
              self._mismatched_markers (keyword_query, parameter_markers)
              return # __init__
 
+          # Binding plans: the keyword argument names, in $n order, that
+          # NamedParameterConnection tries first so that binding a call's
+          # arguments is a single tuple build (lower case first, since that
+          # is how case-insensitive parameters are usually passed...)
+          if case_sensitive:
+             self._binding_plans=(tuple(self._parameters),)
+
+          else:
+                self._binding_plans=(tuple(map(str.lower, self._parameters)),
+                                     tuple(self._parameters)
+                                    )
+
           return # __init__
 
       @property
@@ -310,7 +370,11 @@ class NamedParameterConnection:
           self._close_event_loop_on_err=close_event_loop_on_err
           self._exit_on_err=exit_on_err
 
-          if not isinstance(connection, asyncpg.connection.Connection):
+          # connections acquired from a pool come wrapped in a PoolConnectionProxy
+          if not isinstance(connection, (asyncpg.connection.Connection,
+                                         asyncpg.pool.PoolConnectionProxy
+                                        )
+                           ):
              self._bad_arg ('connection', 'asyncpg.connection.Connection')
              return
 
@@ -337,6 +401,21 @@ class NamedParameterConnection:
           return suffix
 
       def _values(self, parameters):
+          # fast path: the arguments match one of the query's binding plans exactly
+          # (same count, every name present - so nothing missing and nothing left over)
+          for plan in self._named_parameter_query._binding_plans:
+              if len(parameters)!=len(plan):
+                 break
+
+              try:
+                  return tuple(map(parameters.__getitem__, plan))
+
+              except KeyError:
+                     pass
+
+          return self._checked_values(parameters)
+
+      def _checked_values(self, parameters):
           if self._named_parameter_query._case_sensitive:
              fetch_parameters=parameters
              leftover_parameters=set(parameters.keys())
@@ -378,12 +457,57 @@ class NamedParameterConnection:
 
           return values
 
+      async def prepare(self):
+                # explicit prepared statement for the named query, valid until the
+                # connection goes back to its pool (bind values with _values);
+                # across checkouts the pool's statement cache does the reuse...
+                return await self._connection.prepare(self._named_parameter_query._query,
+                                                      timeout=self.timeout
+                                                     )
+
       async def execute(self, **parameters):
                 return await self._connection.execute(self._named_parameter_query._query,
                                                       *self._values(parameters),
                                                       timeout=self.timeout
                                                      )
 
+      async def executemany(self, rows, positional=False):
+                # rows: iterable of dicts of named parameters, one execution per dict
+                # (positional=True: rows are already sequences of values in $n order)
+                return await self._connection.executemany(self._named_parameter_query._query,
+                                                          rows if positional else map(self._values, rows),
+                                                          timeout=self.timeout
+                                                         )
+
+      async def copy_records(self, table, rows, columns=None, positional=False):
+                # COPY rows (dicts of named parameters) into table; the query's
+                # parameters, in $n order, map onto columns position by position
+                # (columns defaults to the parameter names themselves - lower case
+                #  unless the query is case sensitive...; positional=True: rows are
+                #  already sequences of values in $n order)
+                if columns is None:
+                   columns=self._named_parameter_query._binding_plans[0]
+
+                elif len(columns)!=len(self._named_parameter_query._parameters):
+                     self._bad_arg ('columns',
+                                    str(len(self._named_parameter_query._parameters))+' column names'
+                                   )
+
+                return await self._connection.copy_records_to_table(table,
+                                                                    records=rows if positional else map(self._values, rows),
+                                                                    columns=list(columns),
+                                                                    timeout=self.timeout
+                                                                   )
+
+      def cursor(self, prefetch=None, **parameters):
+          # server-side cursor over the named query (iterate with async for,
+          # inside a transaction...)
+          return self._connection.cursor(self._named_parameter_query._query,
+                                         *self._values(parameters),
+                                         prefetch=prefetch,
+                                         timeout=self.timeout
+                                        )
+
       async def fetch(self, **parameters):
                 return await self._connection.fetch(self._named_parameter_query._query,
                                                     *self._values(parameters),
@@ -403,6 +527,24 @@ class NamedParameterConnection:
                                                        timeout=self.timeout
                                                       )
  
+class _RecordingConnection(asyncpg.connection.Connection):
+      # stands in for a live connection in the unit tests below: passes
+      # NamedParameterConnection's type check and records what it was sent...
+      @classmethod
+      def create(cls):
+          connection=object.__new__(cls)
+          connection.calls=[]
+          return connection
+
+      def __del__(self):
+          pass
+
+      async def executemany(self, command, args, timeout=None):
+                self.calls.append (('executemany', command, [tuple(row) for row in args]))
+
+      async def copy_records_to_table(self, table_name, *, records, columns=None, timeout=None):
+                self.calls.append (('copy', table_name, columns, [tuple(record) for record in records]))
+
 class NamedParameterQueryTest(TestCase):
       # The unit testing primarily tests expected types for return values
       # using a query and connection of the user's choosing...
@@ -415,6 +557,91 @@ class NamedParameterQueryTest(TestCase):
           self.assertEqual (named_parameter_query.query, self.QUERY)
           self.assertEqual (named_parameter_query.parameters, self.PARAMETERS)
 
+      def _connection(self, case_sensitive=False):
+          return NamedParameterConnection(_RecordingConnection.create(),
+                                          NamedParameterQuery(self.KEYWORD_QUERY,
+                                                              case_sensitive=case_sensitive
+                                                             )
+                                         )
+
+      def test_binding_plans(self):
+          self.assertEqual (NamedParameterQuery(self.KEYWORD_QUERY)._binding_plans,
+                            (('name', 'age'), ('NAME', 'AGE'))
+                           )
+          self.assertEqual (NamedParameterQuery(self.KEYWORD_QUERY, case_sensitive=True)._binding_plans,
+                            (('NAME', 'AGE'),)
+                           )
+
+      def test_values_fast_path(self):
+          # keywords in any order, lower or upper case: bound in $n order
+          connection=self._connection()
+          for parameters in ({'age': 20, 'name': 'Mr.Big'}, {'AGE': 20, 'NAME': 'Mr.Big'}):
+              self.assertEqual (tuple(connection._values(parameters)), ('Mr.Big', 20))
+              self.assertEqual (list(connection._values(parameters)),
+                                connection._checked_values(parameters)
+                               )
+
+      def test_values_mixed_case(self):
+          # no binding plan matches, so the checked path binds them
+          connection=self._connection()
+          for parameters in ({'Name': 'Mr.Big', 'age': 20}, {'name': 'Mr.Big', 'AGE': 20}):
+              self.assertEqual (list(connection._values(parameters)), ['Mr.Big', 20])
+
+      def test_values_missing_and_extra(self):
+          connection=self._connection()
+          for parameters in ({'name': 'Mr.Big'},
+                             {'name': 'Mr.Big', 'age': 20, 'height': 180},
+                             {'name': 'Mr.Big', 'height': 180},
+                             {}
+                            ):
+              with self.assertRaises (KeyError):
+                   connection._values(parameters)
+
+      def test_values_case_sensitive(self):
+          connection=self._connection(case_sensitive=True)
+          self.assertEqual (tuple(connection._values({'AGE': 20, 'NAME': 'Mr.Big'})), ('Mr.Big', 20))
+          with self.assertRaises (KeyError):
+               connection._values({'age': 20, 'name': 'Mr.Big'})
+
+      def test_executemany(self):
+          connection=self._connection()
+          asyncio.run(connection.executemany([{'age': 20, 'name': 'a'}, {'NAME': 'b', 'AGE': 30}]))
+          self.assertEqual (connection._connection.calls,
+                            [('executemany', self.QUERY, [('a', 20), ('b', 30)])]
+                           )
+          connection._connection.calls.clear()
+          asyncio.run(connection.executemany([('c', 40)], positional=True))
+          self.assertEqual (connection._connection.calls, [('executemany', self.QUERY, [('c', 40)])])
+
+      def test_executemany_checks_every_row(self):
+          connection=self._connection()
+          with self.assertRaises (KeyError):
+               asyncio.run(connection.executemany([{'age': 20, 'name': 'a'}, {'name': 'b'}]))
+
+      def test_copy_records(self):
+          # parameters map onto columns by position: default names, or the given columns
+          connection=self._connection()
+          asyncio.run(connection.copy_records('people', [{'age': 20, 'name': 'a'}]))
+          asyncio.run(connection.copy_records('people', [{'AGE': 30, 'NAME': 'b'}],
+                                              columns=('full_name', 'years')
+                                             )
+                     )
+          asyncio.run(connection.copy_records('people', [('c', 40)], columns=('full_name', 'years'),
+                                              positional=True
+                                             )
+                     )
+          self.assertEqual (connection._connection.calls,
+                            [('copy', 'people', ['name', 'age'], [('a', 20)]),
+                             ('copy', 'people', ['full_name', 'years'], [('b', 30)]),
+                             ('copy', 'people', ['full_name', 'years'], [('c', 40)])
+                            ]
+                           )
+
+      def test_copy_records_column_count(self):
+          connection=self._connection()
+          with self.assertRaises (ValueError):
+               asyncio.run(connection.copy_records('people', [{'age': 20, 'name': 'a'}], columns=('name',)))
+
 class NamedParameterConnectionTest(TestCase):
       async def setUp(self,
                       connection=None, named_parameter_query=None,
@@ -0,0 +1,284 @@
+"""
+Сквозной бенчмарк потребителя очереди на локальных заменителях (bench/stand_ins.py).
+
+Настоящие MosPass, AccountPool, db.set_pass/set_passes и main.consume_concurrently /
+main.consume_batches работают против поддельного API, поддельной авторизации,
+базы в памяти (или настоящей базы, --dsn) и очереди в памяти.
+Печатает пропуска/сек, p50/p99 обработки сообщения и запроса к API, записи в базу/сек
+и сохраняет результат в bench/results/, чтобы запуски можно было сравнивать.
+
+Примеры:
+    python bench/e2e.py --passes 5000 --accounts 4 --latency 0.05
+    python bench/e2e.py --mode batch --unauthorized 0.01 --throttled 0.02
+    python bench/e2e.py --history
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import glob
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+# config.py читает logging.json из текущего каталога
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+import config  # noqa: E402
+import db  # noqa: E402
+import metrics  # noqa: E402
+import passes  # noqa: E402
+import workitems  # noqa: E402
+from bench.stand_ins import FakeApi, FakeBroker, FakeChannel, FakeDatabase, FakeProxies, fake_auth  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Сквозной бенчмарк на локальных заменителях')
+    parser.add_argument('--mode', choices=['async', 'batch'], default='async')
+    parser.add_argument('--passes', type=int, default=2000, help='сколько номеров обработать')
+    parser.add_argument('--start', type=int, default=1, help='первый номер')
+    parser.add_argument('--series', default='БА')
+    parser.add_argument('--range-size', type=int, default=1,
+                        help='номеров в одном сообщении; больше 1 - диапазоны через parse_range')
+    parser.add_argument('--accounts', type=int, default=4)
+    parser.add_argument('--prefetch', type=int, default=config.MQ.prefetch)
+    parser.add_argument('--concurrency', type=int, default=config.MQ.concurrency)
+    parser.add_argument('--batch-size', type=int, default=config.MQ.batch_size)
+    parser.add_argument('--batch-timeout', type=int, default=config.MQ.batch_timeout, help='мс')
+    # Поддельное API
+    parser.add_argument('--latency', type=float, default=0.05, help='средняя задержка API, сек')
+    parser.add_argument('--jitter', type=float, default=0.02, help='разброс задержки API, сек')
+    parser.add_argument('--hit-ratio', type=float, default=0.5, help='доля существующих номеров')
+    parser.add_argument('--unauthorized', type=float, default=0.0, help='вероятность 401 (истёкшая сессия)')
+    parser.add_argument('--malformed', type=int, default=0, help='сколько неразбираемых сообщений подмешать')
+    parser.add_argument('--throttled', type=float, default=0.0, help='вероятность 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After для 429, сек')
+    parser.add_argument('--proxies', type=int, default=0, help='сколько поддельных прокси (0 - напрямую)')
+    parser.add_argument('--bad-proxies', type=int, default=0, help='сколько из них почти всегда отвечают 403')
+    parser.add_argument('--auth-latency', type=float, default=1.0, help='время поддельной авторизации, сек')
+    parser.add_argument('--seed', type=int, default=0)
+    # База
+    parser.add_argument('--dsn', help='настоящая база (отдельная, для тестов) вместо базы в памяти')
+    parser.add_argument('--db-latency', type=float, default=0.001, help='стоимость оператора в памяти, сек')
+    parser.add_argument('--db-row-latency', type=float, default=0.00002, help='стоимость строки в памяти, сек')
+    # Прочее
+    parser.add_argument('--timeout', type=float, default=600, help='прервать прогон через столько сек')
+    parser.add_argument('--keep-logging', action='store_true',
+                        help='оставить обработчики logging.json (по умолчанию - только WARNING в консоль)')
+    parser.add_argument('--verbose', action='store_true', help='не глушить print()')
+    parser.add_argument('--label', default='', help='подпись прогона в результатах')
+    parser.add_argument('--no-save', action='store_true')
+    parser.add_argument('--history', action='store_true', help='показать сохранённые прогоны и выйти')
+    return parser.parse_args()
+
+
+def percentiles(values) -> dict:
+    if len(values) < 2:
+        return {'p50': values[0] if values else None, 'p99': values[0] if values else None}
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+    return {'p50': cuts[49], 'p99': cuts[98]}
+
+
+def counter_total(counter: metrics.Counter, **labels) -> float:
+    positions = {name: i for i, name in enumerate(counter.labelnames)}
+    return sum(child.value for values, child in counter._children.items()
+               if all(values[positions[name]] == value for name, value in labels.items()))
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+MALFORMED = 'not-a-pass'
+
+
+def work_items(args) -> list:
+    stop = args.start + args.passes - 1
+    if args.range_size > 1:
+        items = list(workitems.split_range(args.series, args.start, stop, args.range_size))
+    else:
+        items = [workitems.format_pass(number, args.series) for number in range(args.start, stop + 1)]
+    # Неразбираемые сообщения - поровну по очереди
+    step = len(items) // (args.malformed + 1)
+    for i in range(args.malformed, 0, -1):
+        items.insert(i * step, MALFORMED)
+    return items
+
+
+def timed_request(latencies: list):
+    # Время каждого HTTP-запроса MosPass, без ожидания слотов лимитера
+    request = passes.MosPass._request.__func__
+
+    async def _request(cls, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await request(cls, *args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+    return classmethod(_request)
+
+
+async def run(main, args, api_latencies: list) -> dict:
+    broker = FakeBroker(work_items(args))
+    channel = FakeChannel(broker)
+    consume = main.consume_batches if args.mode == 'batch' else main.consume_concurrently
+    started = time.perf_counter()
+    timed_out = False
+    try:
+        await asyncio.wait_for(consume(channel), args.timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+    if channel.consumer is not None:
+        channel.consumer.cancel()
+    elapsed = time.perf_counter() - started
+    await db.flush_checked()
+    numbers = sum(len(workitems.parse_item(body)) for body in work_items(args) if body != MALFORMED)
+    done = numbers if broker.done else None
+    return {
+        'elapsed': elapsed,
+        'timed_out': timed_out,
+        'messages': broker.total,
+        'acked': broker.acked,
+        'nacked': broker.nacked,
+        'rejected': broker.rejected,
+        'passes': done,
+        'passes_per_sec': done / elapsed if done else broker.acked * args.range_size / elapsed,
+        'message_latency': percentiles(broker.latencies),
+        'api_latency': percentiles(api_latencies),
+        'api_requests': len(api_latencies),
+    }
+
+
+def history():
+    for path in sorted(glob.glob(os.path.join(RESULTS_DIR, '*.json'))):
+        with open(path) as f:
+            run_ = json.load(f)
+        results, params = run_['results'], run_['params']
+        print(f"{run_['started'][:19]}  {run_.get('commit') or '-':>9}  {params['mode']:>5}  "
+              f"{results['passes_per_sec']:8.1f} проп./сек  "
+              f"p99 API {results['api_latency']['p99'] or 0:6.3f} с  "
+              f"запись {results['db_rows_per_sec']:8.1f} стр./сек  {run_.get('label', '')}")
+
+
+def main_():
+    args = parse_args()
+    if args.history:
+        history()
+        return
+    if not args.keep_logging:
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        handler = logging.StreamHandler()
+        handler.setLevel(logging.WARNING)
+        root.addHandler(handler)
+
+    api = FakeApi(args.latency, args.jitter, args.hit_ratio, args.unauthorized, args.throttled,
+                  args.retry_after, args.seed).start()
+    config.API.url = api.url
+    config.MQ.prefetch = args.prefetch
+    config.MQ.concurrency = args.concurrency
+    config.MQ.batch_size = args.batch_size
+    config.MQ.batch_timeout = args.batch_timeout
+    proxies = None
+    if args.proxies:
+        proxies = FakeProxies(args.proxies, args.bad_proxies, seed=args.seed).start()
+        config.PROXY.source_url = proxies.list_url
+    config.PROXY.enabled = proxies is not None
+    # Отметки с прошлых прогонов исказили бы число запросов
+    config.NEGINDEX.enabled = False
+    passes.docker_run_async = fake_auth(api, args.auth_latency)
+    api_latencies = []
+    passes.MosPass._request = timed_request(api_latencies)
+
+    logins = [f'bench{i}' for i in range(args.accounts)]
+    database = None
+    if args.dsn:
+        config.DB.dsn = args.dsn
+
+        async def add_accounts():
+            for login in logins:
+                await db.set_account(login, 'bench', api.issue_cookie())
+            await db.close_pool()
+        asyncio.run(add_accounts())
+    else:
+        database = FakeDatabase(args.db_latency, args.db_row_latency, config.DB.max_size)
+        for login in logins:
+            database.add_account(login, 'bench', api.issue_cookie())
+        db.get_pool = database.get_pool
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    with output:
+        import main
+        # Цикл событий процесса и аккаунты - как при обычном запуске main.py
+        main.init()
+        try:
+            results = main.LOOP.run_until_complete(run(main, args, api_latencies))
+            if main.ACCOUNTS.cache is not None:
+                results['cache'] = main.ACCOUNTS.cache.stats()
+        finally:
+            main.LOOP.run_until_complete(main.ACCOUNTS.close())
+            main.LOOP.run_until_complete(db.close_pool())
+            api.stop()
+            if proxies is not None:
+                proxies.stop()
+
+    db_rows = counter_total(metrics.DB_PASSES, result='changed')
+    results.update({
+        'api_statuses': {str(status): count for status, count in sorted(api.statuses.items())},
+        'auths': counter_total(metrics.API_AUTH),
+        'db_rows': db_rows,
+        'db_rows_per_sec': db_rows / results['elapsed'],
+    })
+    if proxies is not None:
+        # Ответы по прокси: у выведенных из ротации "плохих" прокси 403 перестают расти
+        results['proxy_statuses'] = {url: {str(status): count for status, count in sorted(statuses.items())}
+                                     for url, statuses in proxies.statuses.items()}
+    if database is not None:
+        results.update({
+            'db_statements': database.statements,
+            'db_statements_per_sec': database.statements / results['elapsed'],
+            'db_rows_written': database.rows_written,
+            'db_rows_unchanged': database.rows_unchanged,
+        })
+
+    print(f"Режим {args.mode}: {results['passes_per_sec']:.1f} проп./сек за {results['elapsed']:.1f} с"
+          f"{' (прервано по таймауту)' if results['timed_out'] else ''}")
+    print(f"Сообщение p50/p99: {results['message_latency']['p50']:.3f} / {results['message_latency']['p99']:.3f} с")
+    print(f"API p50/p99: {results['api_latency']['p50']:.3f} / {results['api_latency']['p99']:.3f} с, "
+          f"ответы {results['api_statuses']}, авторизаций {results['auths']:.0f}")
+    print(f"Запись: {results['db_rows_per_sec']:.1f} стр./сек ({results['db_rows']:.0f} строк)"
+          + (f", обращений к БД: {results['db_statements']}" if 'db_statements' in results else ''))
+    if 'cache' in results:
+        print(f"Кэш: {results['cache']}")
+    for url, statuses in results.get('proxy_statuses', {}).items():
+        print(f"Прокси {url}: {statuses}")
+
+    if not args.no_save:
+        started = datetime.datetime.now()
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"e2e-{started:%Y%m%d-%H%M%S}.json")
+        with open(path, 'w') as f:
+            json.dump({
+                'started': started.isoformat(),
+                'commit': git_commit(),
+                'label': args.label,
+                'params': vars(args),
+                'results': results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f'Сохранено: {os.path.relpath(path, ROOT)}')
+
+
+if __name__ == '__main__':
+    main_()
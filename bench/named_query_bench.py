@@ -0,0 +1,63 @@
+"""Микробенчмарк привязки именованных параметров.
+
+Сравнивает стоимость одного вызова db.set_pass без похода в базу:
+  before - прочитать sql/insert_pass.sql, разобрать его в NamedParameterQuery,
+           создать NamedParameterConnection и проверить аргументы по-старому;
+  after  - взять скомпилированный запрос из кэша и собрать кортеж по плану.
+
+Запуск из корня репозитория: python bench/named_query_bench.py [число повторов]
+"""
+import os
+import sys
+import timeit
+
+import asyncpg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from asyncpg_utility import NamedParameterConnection, NamedParameterQuery, load_query  # noqa: E402
+from db import SQL_DIR  # noqa: E402
+from records import PassRecord  # noqa: E402
+
+INSERT_PASS = str(SQL_DIR / 'insert_pass.sql')
+
+
+class _Connection(asyncpg.connection.Connection):
+    # Настоящее соединение не нужно: NamedParameterConnection только проверяет тип
+    def __del__(self):
+        pass
+
+
+CONNECTION = object.__new__(_Connection)
+
+# Именованные параметры sql/insert_pass.sql в порядке полей PassRecord
+ARGUMENTS = dict(zip(('series', 'number', 'td', 'status', 'vin', 'reg', 'start', 'finish'), PassRecord.from_response({
+    'seriesAndNumber': 'БА 0000001',
+    'statusCode': 'Active',
+    'passTimeOfDay': 'Дневной',
+    'vin': 'XTA000000000000000',
+    'regNum': 'А000АА777',
+    'startDate': '2024-01-01T00:00:00Z',
+    'finishDate': '2024-12-31T00:00:00Z',
+})))
+
+
+def before():
+    with open(INSERT_PASS) as f:
+        query = NamedParameterQuery(f.read())
+    return NamedParameterConnection(CONNECTION, query)._checked_values(ARGUMENTS)
+
+
+def after():
+    return NamedParameterConnection(CONNECTION, load_query(INSERT_PASS))._values(ARGUMENTS)
+
+
+def main(number=20000):
+    assert list(before()) == list(after())
+    for name, fn in (('before', before), ('after', after)):
+        best = min(timeit.repeat(fn, number=number, repeat=5))
+        print(f'{name:>6}: {best / number * 1e6:8.2f} мкс/вызов')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:2]))
@@ -0,0 +1,112 @@
+"""Разбор ответов API: словарь ответа + _pass_arguments против PassRecord.
+
+before - как было: потребитель держит весь словарь ответа, а db.set_passes разбирает
+         его в словарь параметров (два split, два strptime);
+after  - PassRecord.from_response сразу после ответа API.
+
+Печатает время разбора одной записи, время db-подготовки пачки (ключ и отпечаток)
+и память, которую занимает пачка разобранных записей.
+
+Запуск из корня репозитория: python bench/records_bench.py [размер пачки]
+"""
+import datetime
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import PassRecord  # noqa: E402
+
+
+def response(number: int) -> dict:
+    # Ответ API в том виде, в каком его отдаёт aiohttp: все поля, а не только нужные
+    return json.loads(json.dumps({
+        'seriesAndNumber': f'БА {number:07d}',
+        'statusCode': 'Active' if number % 5 else 'Cancelled',
+        'passTimeOfDay': 'Дневной',
+        'vin': f'XTA{number:014X}',
+        'regNum': f'А{number % 1000:03d}АА77',
+        'startDate': '2024-01-01T00:00:00Z',
+        'finishDate': '2025-01-01T00:00:00Z',
+        'passType': 'Грузовой',
+        'zone': 'СК',
+        'issuedBy': 'ДТиРДТИ',
+        'cancelDate': None,
+        'ecoClass': 5,
+    }, ensure_ascii=False))
+
+
+def pass_arguments(pass_dict: dict) -> dict:
+    # db._pass_arguments до PassRecord
+    series = str(pass_dict['seriesAndNumber']).split(' ')[0].strip()
+    number = str(pass_dict['seriesAndNumber']).split(' ')[1].strip()
+    if pass_dict['statusCode'] == 'Active':
+        status = True
+    else:
+        status = False
+    return {
+        'series': series,
+        'number': number,
+        'td': pass_dict['passTimeOfDay'],
+        'status': status,
+        'vin': pass_dict['vin'],
+        'reg': pass_dict['regNum'],
+        'start': datetime.datetime.strptime(pass_dict['startDate'], '%Y-%m-%dT%H:%M:%SZ'),
+        'finish': datetime.datetime.strptime(pass_dict['finishDate'], '%Y-%m-%dT%H:%M:%SZ')
+    }
+
+
+def prepare_before(responses):
+    rows = {}
+    for pass_dict in responses:
+        arguments = pass_arguments(pass_dict)
+        rows[(arguments['series'], arguments['number'])] = arguments
+    return {key: hash(tuple(arguments.values())) for key, arguments in rows.items()}
+
+
+def prepare_after(records):
+    rows = {record.key: record for record in records}
+    return {key: hash(record) for key, record in rows.items()}
+
+
+def timed(function, *args) -> float:
+    started = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - started
+
+
+def held(build) -> int:
+    """Байт памяти под результат build()."""
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main(size=100000):
+    numbers = range(1, size + 1)
+    # Потребитель до изменения держал словари ответов, после - только PassRecord
+    responses = [response(number) for number in numbers]
+    records = [PassRecord.from_response(res) for res in responses]
+    assert list(prepare_before(responses)) == list(prepare_after(records))
+
+    parse_before = min(timed(lambda: [pass_arguments(res) for res in responses]) for _ in range(3))
+    parse_after = min(timed(lambda: [PassRecord.from_response(res) for res in responses]) for _ in range(3))
+    db_before = min(timed(prepare_before, responses) for _ in range(3))
+    db_after = min(timed(prepare_after, records) for _ in range(3))
+    memory_before = held(lambda: [response(number) for number in numbers])
+    memory_after = held(lambda: [PassRecord.from_response(response(number)) for number in numbers])
+
+    print(f'Пачка {size} записей')
+    print(f'разбор:       {parse_before / size * 1e6:6.2f} -> {parse_after / size * 1e6:6.2f} мкс/запись')
+    print(f'set_passes:   {db_before / size * 1e6:6.2f} -> {db_after / size * 1e6:6.2f} мкс/запись')
+    print(f'память:       {memory_before / size:6.0f} -> {memory_after / size:6.0f} байт/запись')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:2]))
@@ -0,0 +1,474 @@
+"""
+Локальные заменители внешних систем для bench/e2e.py.
+
+FakeApi      - HTTP-сервер вместо /api/Pass/GetPassBySeriesAndNumber в отдельном потоке:
+               задержка, доля найденных пропусков, 401 (истёкшая сессия) и 429.
+FakeProxies  - несколько HTTP-прокси перед FakeApi и список их адресов, как у ipArch
+               (config.PROXY.source_url): "плохие" прокси отвечают 403 (бан адреса).
+fake_auth    - замена passes.docker_run_async: выдаёт новые куки FakeApi и пишет их
+               в passes.accounts, как это делает образ авторизации.
+FakeDatabase - пул и соединения asyncpg в памяти: запросы db.py узнаются по тексту,
+               у каждого оператора и строки своя стоимость.
+FakeBroker   - очередь RabbitMQ в памяти с ack/nack(multiple)/reject и prefetch, которую
+               читают настоящие main.consume_concurrently и main.consume_batches.
+"""
+import asyncio
+import collections
+import contextlib
+import datetime
+import random
+import re
+import secrets
+import threading
+import time
+
+import asyncpg
+import aiohttp
+from aiohttp import web
+
+import db
+
+
+class FakeApi:
+    def __init__(self, latency=0.05, jitter=0.02, hit_ratio=0.5, unauthorized=0.0, throttled=0.0,
+                 retry_after=1, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.hit_ratio = hit_ratio
+        self.unauthorized = unauthorized
+        self.throttled = throttled
+        self.retry_after = retry_after
+        self.seed = seed
+        self.statuses = collections.Counter()
+        # Действующие куки; 401-инъекция "истекает" куки, пока fake_auth не выдаст новые
+        self.cookies = set()
+        self.url = None
+        self._random = random.Random(seed)
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    def issue_cookie(self) -> str:
+        cookie = secrets.token_hex(16)
+        self.cookies.add(cookie)
+        return cookie
+
+    def _pass(self, series_and_number: str) -> dict | None:
+        series, number = re.fullmatch(r'(\D+)(\d+)', series_and_number).groups()
+        # Найден ли номер - решено заранее, одинаково от запуска к запуску
+        numbered = random.Random(f'{self.seed}:{series_and_number}')
+        if numbered.random() >= self.hit_ratio:
+            return None
+        return {
+            'seriesAndNumber': f'{series} {number}',
+            'statusCode': 'Active' if numbered.random() < 0.8 else 'Cancelled',
+            'passTimeOfDay': 'Дневной',
+            'vin': f'XTA{numbered.getrandbits(48):014X}',
+            'regNum': f'А{int(number) % 1000:03d}АА77',
+            'startDate': '2024-01-01T00:00:00Z',
+            'finishDate': '2025-01-01T00:00:00Z'
+        }
+
+    async def _handle(self, request):
+        delay = self._random.gauss(self.latency, self.jitter) if self.jitter else self.latency
+        await asyncio.sleep(max(0.0, delay))
+        cookie = request.cookies.get('.AspNetCore.Cookies')
+        if cookie not in self.cookies:
+            status = 401
+        elif self._random.random() < self.unauthorized:
+            self.cookies.discard(cookie)
+            status = 401
+        elif self._random.random() < self.throttled:
+            self.statuses[429] += 1
+            return web.Response(status=429, headers={'Retry-After': str(self.retry_after)})
+        else:
+            found = self._pass(request.query['SeriesAndNumber'])
+            if found is not None:
+                self.statuses[200] += 1
+                return web.json_response(found)
+            status = 404
+        self.statuses[status] += 1
+        return web.Response(status=status)
+
+    def start(self) -> 'FakeApi':
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            app = web.Application()
+            app.router.add_get('/api/Pass/GetPassBySeriesAndNumber', self._handle)
+            self._runner = web.AppRunner(app, access_log=None)
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, '127.0.0.1', 0)
+            self._loop.run_until_complete(site.start())
+            port = site._server.sockets[0].getsockname()[1]
+            self.url = f'http://127.0.0.1:{port}/api/Pass/GetPassBySeriesAndNumber'
+            ready.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self._runner.cleanup())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name='fake-api', daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+
+class FakeProxies:
+    """
+    count прокси в одном потоке: запрос в абсолютной форме ("GET http://... HTTP/1.1")
+    пересылается как есть. Первые bad прокси отвечают 403 с вероятностью ban_rate,
+    не пересылая запрос. GET / на list_url - JSON-список адресов прокси.
+    """
+
+    def __init__(self, count=4, bad=0, ban_rate=0.9, latency=0.0, seed=0):
+        self.count = count
+        self.bad = bad
+        self.ban_rate = ban_rate
+        self.latency = latency
+        self.urls = []
+        self.list_url = None
+        # Адрес прокси -> Counter ответов, которые он отдал
+        self.statuses = collections.defaultdict(collections.Counter)
+        self._random = random.Random(seed)
+        self._session = None
+        self._loop = None
+        self._runners = []
+        self._thread = None
+
+    def _proxy_handler(self, index: int):
+        async def handle(request):
+            url = self.urls[index]
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if index < self.bad and self._random.random() < self.ban_rate:
+                self.statuses[url][403] += 1
+                return web.Response(status=403)
+            headers = {key: value for key, value in request.headers.items()
+                       if key.lower() not in ('host', 'proxy-connection', 'connection')}
+            async with self._session.get(str(request.url), headers=headers, allow_redirects=False) as r:
+                body = await r.read()
+                reply = web.Response(status=r.status, body=body, content_type=r.content_type)
+                for key in ('Retry-After', 'Set-Cookie'):
+                    for value in r.headers.getall(key, ()):
+                        reply.headers.add(key, value)
+            self.statuses[url][r.status] += 1
+            return reply
+        return handle
+
+    async def _list(self, request):
+        return web.json_response(self.urls)
+
+    async def _site(self, app) -> str:
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        self._runners.append(runner)
+        return f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}'
+
+    async def _start(self):
+        self._session = aiohttp.ClientSession(cookie_jar=aiohttp.DummyCookieJar())
+        for index in range(self.count):
+            app = web.Application()
+            app.router.add_route('GET', '/{path:.*}', self._proxy_handler(index))
+            self.urls.append(await self._site(app))
+        app = web.Application()
+        app.router.add_get('/', self._list)
+        self.list_url = await self._site(app) + '/'
+
+    async def _stop(self):
+        for runner in self._runners:
+            await runner.cleanup()
+        await self._session.close()
+
+    def start(self) -> 'FakeProxies':
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._start())
+            ready.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self._stop())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name='fake-proxies', daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+
+def fake_auth(api: FakeApi, latency: float = 1.0):
+    """Замена passes.docker_run_async для образа авторизации."""
+    async def docker_run_async(image, env: dict | None = None, command: str | None = None,
+                               autoremove_container=True, timeout=None):
+        await asyncio.sleep(latency)
+        await db.set_account(env['USERNAME'], env['PASSWORD'], api.issue_cookie())
+        return 0, '', ''
+    return docker_run_async
+
+
+class _Transaction:
+    # BEGIN и COMMIT - такие же обращения к базе, как и операторы внутри
+    def __init__(self, database):
+        self.database = database
+
+    async def __aenter__(self):
+        await self.database.cost()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.database.cost()
+        return False
+
+
+class FakeConnection(asyncpg.connection.Connection):
+    """Проходит проверку типа в NamedParameterConnection; сам ничего не соединяет."""
+
+    def __del__(self):
+        pass
+
+    @classmethod
+    def create(cls, database):
+        connection = object.__new__(cls)
+        connection.database = database
+        connection.staging = []
+        return connection
+
+    def transaction(self, **kwargs):
+        return _Transaction(self.database)
+
+    async def execute(self, query, *args, timeout=None):
+        return await self.database.run(self, query, args)
+
+    async def fetch(self, query, *args, timeout=None):
+        return await self.database.run(self, query, args)
+
+    async def fetchval(self, query, *args, column=0, timeout=None):
+        return await self.database.run(self, query, args)
+
+    async def executemany(self, command, args, timeout=None):
+        rows = list(args)
+        await self.database.cost(len(rows))
+        for row in rows:
+            self.database.upsert(row)
+
+    async def copy_records_to_table(self, table_name, *, records, columns=None, timeout=None, **kwargs):
+        rows = list(records)
+        await self.database.cost(len(rows))
+        self.staging.extend(rows)
+        return f'COPY {len(rows)}'
+
+
+class FakeDatabase:
+    def __init__(self, latency=0.001, row_latency=0.00002, max_connections=10):
+        self.latency = latency
+        self.row_latency = row_latency
+        self.max_connections = max_connections
+        self.accounts = {}
+        self.passes = {}
+        self.range_progress = {}
+        self.statements = 0
+        self.rows_written = 0
+        self.rows_unchanged = 0
+        self.rows_touched = 0
+        self._semaphore = None
+        self._handlers = {
+            db.GET_ACCOUNTS_QUERY.query: lambda conn: list(self.accounts.values()),
+            db.GET_ACCOUNT_QUERY.query: lambda conn, login: [self.accounts[login]] if login in self.accounts else [],
+            db.INSERT_ACCOUNT_QUERY.query: self._set_account,
+            db.GET_LAST_PASS_QUERY.query: self._last_pass,
+            db.INSERT_PASS_QUERY.query: lambda conn, *values: self.upsert(values),
+            db.CREATE_PASS_STAGING_QUERY.query: lambda conn: conn.staging.clear(),
+            db.MERGE_PASS_STAGING_QUERY.query: self._merge,
+            db.TOUCH_PASSES_QUERY.query: self._touch,
+            db.MIGRATE_PASSES_QUERY.query: lambda conn: None,
+            db.CREATE_RANGE_PROGRESS_QUERY.query: lambda conn: None,
+            db.GET_RANGE_PROGRESS_QUERY.query: lambda conn, item: self.range_progress.get(item),
+            db.UPSERT_RANGE_PROGRESS_QUERY.query: self._set_range_progress,
+            db.DELETE_RANGE_PROGRESS_QUERY.query: lambda conn, item: self.range_progress.pop(item, None),
+        }
+
+    def add_account(self, login, password, cookie_value=None):
+        self.accounts[login] = {'login': login, 'password': password, 'cookie_value': cookie_value, 'active': True}
+
+    async def cost(self, rows=1):
+        self.statements += 1
+        await asyncio.sleep(self.latency + self.row_latency * rows)
+
+    async def run(self, conn, query, args):
+        handler = self._handlers.get(query)
+        if handler is None:
+            raise NotImplementedError(f'FakeDatabase: неизвестный запрос {query[:60]!r}')
+        await self.cost()
+        return handler(conn, *args)
+
+    def upsert(self, values):
+        # За полями пропуска у sql/insert_pass.sql идёт {{GRANULARITY}}
+        key, fields = tuple(values[:2]), tuple(values[2:len(db.PASS_COLUMNS)])
+        if self.passes.get(key) == fields:
+            self.rows_unchanged += 1
+        else:
+            self.passes[key] = fields
+            self.rows_written += 1
+
+    def _set_account(self, conn, login, password, cookie_value):
+        self.add_account(login, password, cookie_value)
+
+    def _last_pass(self, conn):
+        numbers = [number for _, number in self.passes]
+        return [{'number': max(numbers)}] if numbers else []
+
+    def _merge(self, conn, granularity):
+        for row in conn.staging:
+            self.upsert(row)
+        conn.staging.clear()
+
+    def _touch(self, conn, series, numbers, granularity):
+        self.rows_touched += len(numbers)
+
+    def _set_range_progress(self, conn, item, done_upto):
+        self.range_progress[item] = max(self.range_progress.get(item, done_upto), done_upto)
+
+    # Интерфейс пула asyncpg, которым пользуется db.connection
+    @contextlib.asynccontextmanager
+    async def acquire(self, timeout=None):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+        async with self._semaphore:
+            yield FakeConnection.create(self)
+
+    async def get_pool(self):
+        return self
+
+    async def close(self):
+        pass
+
+
+class FakeMessage:
+    def __init__(self, broker, body: str, delivery_tag: int):
+        self.broker = broker
+        self.body = body.encode('utf-8')
+        self.delivery_tag = delivery_tag
+        self.timestamp = datetime.datetime.now(datetime.timezone.utc)
+
+    async def ack(self, multiple=False):
+        await self.broker.settle(self, multiple, requeue=None)
+
+    async def nack(self, multiple=False, requeue=True):
+        await self.broker.settle(self, multiple, requeue=requeue)
+
+    async def reject(self, requeue=True):
+        await self.broker.settle(self, False, requeue=requeue)
+
+
+class FakeBroker:
+    """Одна очередь и один канал; закончена, когда подтверждены все сообщения."""
+
+    def __init__(self, bodies):
+        self.ready = collections.deque(bodies)
+        self.total = len(self.ready)
+        self.prefetch = 1
+        self.unacked = collections.OrderedDict()
+        self.delivered_at = {}
+        self.acked = 0
+        self.nacked = 0
+        self.rejected = 0
+        # Время от первой доставки сообщения до его подтверждения, сек
+        self.latencies = []
+        self._first_delivery = {}
+        self._tag = 0
+        self._changed = asyncio.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.acked + self.rejected >= self.total
+
+    async def deliveries(self):
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(
+                    lambda: self.done or (self.ready and len(self.unacked) < self.prefetch))
+                if self.done:
+                    return
+                body = self.ready.popleft()
+                self._tag += 1
+                message = FakeMessage(self, body, self._tag)
+                self.unacked[message.delivery_tag] = message
+                self._first_delivery.setdefault(body, time.perf_counter())
+            yield message
+
+    async def settle(self, message, multiple, requeue):
+        if multiple:
+            tags = [tag for tag in self.unacked if tag <= message.delivery_tag]
+        else:
+            tags = [message.delivery_tag]
+        async with self._changed:
+            for tag in tags:
+                settled = self.unacked.pop(tag)
+                body = settled.body.decode('utf-8')
+                if requeue is None:
+                    self.acked += 1
+                    self.latencies.append(time.perf_counter() - self._first_delivery.pop(body))
+                elif requeue:
+                    self.nacked += 1
+                    self.ready.appendleft(body)
+                else:
+                    # Без requeue сообщение уходит из очереди (в dead-letter)
+                    self.rejected += 1
+                    self._first_delivery.pop(body, None)
+            self._changed.notify_all()
+
+
+class _Iterator:
+    def __init__(self, broker):
+        self.broker = broker
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def __aiter__(self):
+        return self.broker.deliveries()
+
+
+class FakeQueue:
+    def __init__(self, channel):
+        self.channel = channel
+
+    def iterator(self):
+        return _Iterator(self.channel.broker)
+
+    async def consume(self, callback):
+        async def deliver():
+            async for message in self.channel.broker.deliveries():
+                await callback(message)
+            for close_callback in self.channel.close_callbacks:
+                close_callback(self.channel, None)
+        self.channel.consumer = asyncio.ensure_future(deliver())
+
+
+class FakeChannel:
+    def __init__(self, broker: FakeBroker):
+        self.broker = broker
+        self.close_callbacks = set()
+        self.consumer = None
+
+    async def set_qos(self, prefetch_count):
+        self.broker.prefetch = prefetch_count
+
+    async def get_queue(self, name):
+        return FakeQueue(self)
@@ -0,0 +1,99 @@
+"""
+Кэш результатов поиска пропусков перед API.
+
+Один и тот же номер часто приходит в очередь несколько раз за минуты (срочные запросы,
+перепроверки, повторные публикации). LookupCache помнит и найденные пропуски, и ответы
+"не существует" - каждые своё время, вытесняет давно не спрашивавшиеся записи (LRU), а
+одновременные запросы одного номера объединяет: в API уходит один запрос, остальные
+ждут его результата. Ошибки не кэшируются - их получают только те, кто ждал этот запрос.
+"""
+import asyncio
+import collections
+import time
+
+import metrics
+
+
+class LookupCache:
+    def __init__(self, size: int, hit_ttl: float, miss_ttl: float):
+        self.size = size
+        self.hit_ttl = hit_ttl
+        self.miss_ttl = miss_ttl
+        # ключ -> (действует до, по time.monotonic; результат); порядок - от давно спрошенных
+        self._entries = collections.OrderedDict()
+        self._in_flight = {}
+        self._counts = collections.Counter()
+        self._hit = metrics.LOOKUP_CACHE.labels('hit')
+        self._miss = metrics.LOOKUP_CACHE.labels('miss')
+        self._coalesced = metrics.LOOKUP_CACHE.labels('coalesced')
+        self._refresh = metrics.LOOKUP_CACHE.labels('refresh')
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _count(self, result: str, counter):
+        self._counts[result] += 1
+        counter.inc()
+
+    def stats(self) -> dict:
+        """Попадания, промахи, объединённые и принудительные запросы, число записей."""
+        return {'hit': self._counts['hit'], 'miss': self._counts['miss'],
+                'coalesced': self._counts['coalesced'], 'refresh': self._counts['refresh'],
+                'size': len(self._entries)}
+
+    def _cached(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def put(self, key, value):
+        ttl = self.miss_ttl if value is None else self.hit_ttl
+        if ttl <= 0:
+            self._entries.pop(key, None)
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    async def _load(self, key, load):
+        try:
+            value = await load()
+            self.put(key, value)
+            return value
+        finally:
+            if self._in_flight.get(key) is asyncio.current_task():
+                del self._in_flight[key]
+
+    async def get(self, key, load, refresh: bool = False):
+        """
+        Результат для key: из кэша, из уже идущего запроса или из await load().
+        refresh=True - мимо кэша и идущих запросов, с обновлением кэша.
+        """
+        if refresh:
+            self._count('refresh', self._refresh)
+            task = asyncio.ensure_future(self._load(key, load))
+            # Идущий запрос остаётся общим для остальных, иначе принудительный становится им
+            self._in_flight.setdefault(key, task)
+        else:
+            found, value = self._cached(key)
+            if found:
+                self._count('hit', self._hit)
+                return value
+            task = self._in_flight.get(key)
+            if task is None:
+                self._count('miss', self._miss)
+                task = self._in_flight[key] = asyncio.ensure_future(self._load(key, load))
+            else:
+                self._count('coalesced', self._coalesced)
+        # Отмена одного ожидающего не отменяет запрос, которого ждут другие
+        return await asyncio.shield(task)
@@ -1,48 +1,136 @@
 import asyncio
+import contextlib
 import datetime
+from collections import OrderedDict
 import logging
+import time
 import traceback
+from pathlib import Path
 
 import asyncpg
 import requests
 
-from asyncpg_utility import NamedParameterQuery, NamedParameterConnection
+from asyncpg_utility import NamedParameterConnection, allocate_pool, compile_query, load_query
 
-from config import DSN
+import metrics
+from config import DB, PROXY
+from records import PassRecord, as_record
 
 LOGGER = logging.getLogger(__name__)
 
+SQL_DIR = Path(__file__).resolve().parent / 'sql'
 
-def get_proxies():
-    url = 'http://ipArch.local:5558/'
+# Запросы разбираются один раз при импорте, а не на каждый вызов
+GET_ACCOUNTS_QUERY = compile_query('SELECT * FROM passes.accounts')
+GET_ACCOUNT_QUERY = compile_query('SELECT * FROM passes.accounts WHERE login = {{USERNAME}}')
+GET_LAST_PASS_QUERY = compile_query('select "number" from passes.passes p order by "number" desc limit 1')
+INSERT_ACCOUNT_QUERY = load_query(SQL_DIR / 'insert_account.sql')
+INSERT_PASS_QUERY = load_query(SQL_DIR / 'insert_pass.sql')
+CREATE_PASS_STAGING_QUERY = load_query(SQL_DIR / 'create_pass_staging.sql')
+MERGE_PASS_STAGING_QUERY = load_query(SQL_DIR / 'merge_pass_staging.sql')
+MIGRATE_PASSES_QUERY = load_query(SQL_DIR / 'migrate_passes.sql')
+TOUCH_PASSES_QUERY = load_query(SQL_DIR / 'touch_passes.sql')
+SELECT_REFRESH_QUERY = load_query(SQL_DIR / 'select_refresh.sql')
+CREATE_RANGE_PROGRESS_QUERY = load_query(SQL_DIR / 'create_range_progress.sql')
+GET_RANGE_PROGRESS_QUERY = compile_query('SELECT done_upto FROM passes.range_progress WHERE item = {{ITEM}}')
+UPSERT_RANGE_PROGRESS_QUERY = load_query(SQL_DIR / 'upsert_range_progress.sql')
+DELETE_RANGE_PROGRESS_QUERY = compile_query('DELETE FROM passes.range_progress WHERE item = {{ITEM}}')
+
+_POOL = None
+_POOL_LOOP = None
+
+# (серия, номер) -> отпечаток последней записанной версии пропуска, в порядке LRU
+_FINGERPRINTS = OrderedDict()
+# (серия, номер) пропусков, которые перепроверены без изменений, но ещё не отмечены в last_checked
+_PENDING_CHECKS = set()
+
+
+async def get_pool():
+    """Общий для всего модуля пул соединений, создаётся при первом обращении."""
+    global _POOL, _POOL_LOOP
+    loop = asyncio.get_running_loop()
+    if _POOL is not None and _POOL_LOOP is not loop:
+        # Пул привязан к циклу событий, в котором создан; старый цикл уже закрыт
+        # (asyncio.run), поэтому соединения можно только оборвать.
+        if _POOL.done() and not _POOL.cancelled() and _POOL.exception() is None:
+            try:
+                _POOL.result().terminate()
+            except Exception:
+                LOGGER.debug('Не удалось оборвать соединения старого пула', exc_info=True)
+        _POOL = None
+    if _POOL is None:
+        # Задача, а не сам пул: параллельные вызовы дождутся одного и того же пула
+        _POOL = asyncio.ensure_future(allocate_pool(
+            dsn=DB.dsn,
+            min_size=DB.min_size,
+            max_size=DB.max_size,
+            statement_cache_size=DB.statement_cache_size if DB.prepare_statements else 0,
+            command_timeout=DB.command_timeout,
+            max_inactive_connection_lifetime=DB.max_inactive_connection_lifetime
+        ))
+        _POOL_LOOP = loop
+    try:
+        return await asyncio.shield(_POOL)
+    except Exception:
+        _POOL = None
+        raise
+
+
+async def close_pool():
+    global _POOL, _POOL_LOOP
+    if _POOL is None:
+        return
+    if _PENDING_CHECKS and _POOL_LOOP is asyncio.get_running_loop():
+        try:
+            await flush_checked()
+        except Exception:
+            LOGGER.warning('Не удалось записать отметки last_checked', exc_info=True)
+    task, _POOL, _POOL_LOOP = _POOL, None, None
+    try:
+        pool = await task
+    except Exception:
+        return
+    try:
+        await asyncio.wait_for(pool.close(), timeout=DB.close_timeout)
+    except asyncio.TimeoutError:
+        LOGGER.warning('Пул соединений не закрылся вовремя, соединения обрываются')
+        pool.terminate()
+
+
+@contextlib.asynccontextmanager
+async def connection():
+    pool = await get_pool()
+    async with pool.acquire(timeout=DB.acquire_timeout) as conn:
+        yield conn
+
+
+def get_proxies(url=None):
+    url = url or PROXY.source_url
     r = requests.get(url)
     return r.json()
 
 
 async def get_account(username=None):
-    conn = await asyncpg.connect(DSN)
     if username is None:
-        query = 'SELECT * FROM passes.accounts'
+        my_named_parameter_query = GET_ACCOUNTS_QUERY
     else:
-        query = 'SELECT * FROM passes.accounts WHERE login = {{USERNAME}}'
-    my_named_parameter_query = NamedParameterQuery(query)
-    my_named_parameter_conn = NamedParameterConnection(conn, my_named_parameter_query)
-    if username is None:
-        results = await my_named_parameter_conn.fetch()
-    else:
-        results = await my_named_parameter_conn.fetch(username=username)
-    for result in results:
-        print(result)
+        my_named_parameter_query = GET_ACCOUNT_QUERY
+    async with connection() as conn:
+        my_named_parameter_conn = NamedParameterConnection(conn, my_named_parameter_query)
+        if username is None:
+            results = await my_named_parameter_conn.fetch()
+        else:
+            results = await my_named_parameter_conn.fetch(username=username)
+    # Только логины: в строках пароль и куки аккаунта
+    LOGGER.debug(f"Аккаунты из passes.accounts: {', '.join(result['login'] for result in results)}")
     return results
 
 
 async def get_last_pass():
     print('try to get last pass')
-    query = 'select "number" from passes.passes p order by "number" desc limit 1'
-    conn = await asyncpg.connect(DSN)
-    my_named_parameter_query = NamedParameterQuery(query)
-    my_named_parameter_conn = NamedParameterConnection(conn, my_named_parameter_query)
-    results = await my_named_parameter_conn.fetch()
+    async with connection() as conn:
+        my_named_parameter_conn = NamedParameterConnection(conn, GET_LAST_PASS_QUERY)
+        results = await my_named_parameter_conn.fetch()
     try:
         return int(results[0]['number'])
     except:
@@ -51,54 +139,203 @@ async def get_last_pass():
 
 
 async def set_account(username, password, cookie_value):
-    conn = await asyncpg.connect(DSN)
-    with open('sql/insert_account.sql') as f:
-        query = f.read()
-    my_named_parameter_query = NamedParameterQuery(query)
-    my_named_parameter_conn = NamedParameterConnection(conn, my_named_parameter_query)
-
-    results = await my_named_parameter_conn.execute(username=username, password=password, cookie=cookie_value)
+    async with connection() as conn:
+        my_named_parameter_conn = NamedParameterConnection(conn, INSERT_ACCOUNT_QUERY)
+        results = await my_named_parameter_conn.execute(username=username, password=password, cookie=cookie_value)
     #print(results)
     return results
 
 
-async def set_pass(pass_dict: dict):
-    conn = await asyncpg.connect(DSN)
-    with open('sql/insert_pass.sql') as f:
-        query = f.read()
-    my_named_parameter_query = NamedParameterQuery(query)
-    my_named_parameter_conn = NamedParameterConnection(conn, my_named_parameter_query)
-    series = str(pass_dict['seriesAndNumber']).split(' ')[0].strip()
-    number = str(pass_dict['seriesAndNumber']).split(' ')[1].strip()
-    if pass_dict['statusCode'] == 'Active':
-        status = True
+# Колонки passes.passes в порядке полей PassRecord и параметров sql/insert_pass.sql
+PASS_COLUMNS = PassRecord._fields
+
+
+async def set_pass(record: PassRecord | dict):
+    return await set_passes([record], method='executemany')
+
+
+def _granularity() -> datetime.timedelta:
+    return datetime.timedelta(seconds=DB.checked_granularity)
+
+
+async def _write_passes(conn, rows, method):
+    if method == 'copy':
+        await conn.execute(CREATE_PASS_STAGING_QUERY.query)
+        # Поля PassRecord идут в порядке колонок passes_staging
+        await conn.copy_records_to_table('passes_staging', records=rows.values(), columns=PASS_COLUMNS)
+        my_named_parameter_conn = NamedParameterConnection(conn, MERGE_PASS_STAGING_QUERY)
+        await my_named_parameter_conn.execute(granularity=_granularity())
+    elif method == 'executemany':
+        my_named_parameter_conn = NamedParameterConnection(conn, INSERT_PASS_QUERY)
+        # Параметры sql/insert_pass.sql: поля PassRecord по порядку, затем {{GRANULARITY}}
+        granularity = _granularity()
+        await my_named_parameter_conn.executemany([(*record, granularity) for record in rows.values()],
+                                                  positional=True)
     else:
-        status = False
-    arguments = {
-        'series': series,
-        'number': number,
-        'td': pass_dict['passTimeOfDay'],
-        'status': status,
-        'vin': pass_dict['vin'],
-        'reg': pass_dict['regNum'],
-        'start': datetime.datetime.strptime(pass_dict['startDate'], '%Y-%m-%dT%H:%M:%SZ'),
-        'finish': datetime.datetime.strptime(pass_dict['finishDate'], '%Y-%m-%dT%H:%M:%SZ')
-    }
-    results = await my_named_parameter_conn.execute(**arguments)
-    #print(results)
-    return results
+        raise ValueError(f'Неизвестный способ пакетной записи: {method}')
+
+
+async def _touch_passes(conn, keys):
+    my_named_parameter_conn = NamedParameterConnection(conn, TOUCH_PASSES_QUERY)
+    return await my_named_parameter_conn.execute(
+        series=[series for series, _ in keys],
+        number=[number for _, number in keys],
+        granularity=_granularity()
+    )
+
+
+def _remember(fingerprints):
+    for key, fingerprint in fingerprints.items():
+        _FINGERPRINTS[key] = fingerprint
+        _FINGERPRINTS.move_to_end(key)
+    while len(_FINGERPRINTS) > DB.fingerprint_cache_size:
+        _FINGERPRINTS.popitem(last=False)
+
+
+async def set_passes(records, method=None):
+    """
+    Пакетная запись пропусков: PassRecord (или словарей ответа API).
+    method='copy' - COPY во временную таблицу и один INSERT ... ON CONFLICT из неё,
+    method='executemany' - запасной вариант через sql/insert_pass.sql.
+    Пропуски, совпавшие с недавно записанными (по отпечатку), в базу не идут - им только
+    копится отметка last_checked. Upsert обновляет строку, если поля отличаются, а у
+    совпавших сдвигает только last_checked, если отметка старше DB.checked_granularity.
+    Накопленные отметки ставятся одним UPDATE (sql/touch_passes.sql) в той же транзакции;
+    без них одиночная запись executemany - один оператор без явной транзакции.
+    Возвращает число пропусков, отправленных на запись.
+    """
+    method = method or DB.bulk_method
+    # В одном INSERT ... ON CONFLICT строка не может обновиться дважды,
+    # поэтому повторы внутри пачки схлопываются (побеждает последний)
+    rows = {}
+    for record in records:
+        record = as_record(record)
+        rows[record.key] = record
+    changed = {}
+    fingerprints = {}
+    for key, record in rows.items():
+        fingerprint = hash(record)
+        if _FINGERPRINTS.get(key) == fingerprint:
+            _FINGERPRINTS.move_to_end(key)
+            _PENDING_CHECKS.add(key)
+        else:
+            changed[key] = record
+            fingerprints[key] = fingerprint
+    metrics.DB_PASSES.labels('changed').inc(len(changed))
+    metrics.DB_PASSES.labels('unchanged').inc(len(rows) - len(changed))
+    if not changed:
+        if len(_PENDING_CHECKS) >= DB.checked_batch_size:
+            await flush_checked()
+        return 0
+    # Накопленные отметки уходят заодно с пачкой
+    pending = list(_PENDING_CHECKS)
+    _PENDING_CHECKS.clear()
+    started = time.perf_counter()
+    try:
+        for attempt in (1, 2):
+            try:
+                async with connection() as conn:
+                    if method == 'executemany' and not pending:
+                        # executemany и без транзакции атомарен
+                        await _write_passes(conn, changed, method)
+                    else:
+                        async with conn.transaction():
+                            await _write_passes(conn, changed, method)
+                            if pending:
+                                await _touch_passes(conn, pending)
+                break
+            except asyncpg.exceptions.InvalidCachedStatementError:
+                # Схема поменялась, а у соединения остался подготовленный по старой схеме
+                # оператор. Внутри транзакции asyncpg сам не повторяет, но кэши пула он
+                # уже сбросил, так что второй заход подготовит запрос заново.
+                if attempt == 2:
+                    raise
+                LOGGER.warning('Подготовленный запрос устарел, повторяем пачку')
+    except BaseException:
+        _PENDING_CHECKS.update(pending)
+        raise
+    metrics.DB_WRITE_LATENCY.labels(method).observe(time.perf_counter() - started)
+    _remember(fingerprints)
+    LOGGER.debug(f'Записано пропусков пачкой ({method}): {len(changed)}, без изменений: {len(rows) - len(changed)}')
+    return len(changed)
+
+
+async def flush_checked():
+    """Ставит last_checked перепроверенным без изменений пропускам (с устаревшей отметкой) одним UPDATE."""
+    pending = list(_PENDING_CHECKS)
+    _PENDING_CHECKS.clear()
+    if not pending:
+        return 0
+    started = time.perf_counter()
+    try:
+        async with connection() as conn:
+            await _touch_passes(conn, pending)
+    except BaseException:
+        _PENDING_CHECKS.update(pending)
+        raise
+    metrics.DB_WRITE_LATENCY.labels('last_checked').observe(time.perf_counter() - started)
+    return len(pending)
+
+
+async def get_refresh_candidates(limit, max_priority, stale_after, min_age):
+    """
+    Пропуски для перепроверки по sql/select_refresh.sql в порядке приоритета, не больше limit.
+    Читаются одним запросом целиком: отправка в очередь идёт с ограниченной скоростью
+    и не должна держать ни соединение, ни открытую транзакцию.
+    """
+    async with connection() as conn:
+        my_named_parameter_conn = NamedParameterConnection(conn, SELECT_REFRESH_QUERY)
+        return await my_named_parameter_conn.fetch(
+            limit=limit,
+            max_priority=max_priority,
+            stale_after=datetime.timedelta(seconds=stale_after),
+            min_age=datetime.timedelta(seconds=min_age)
+        )
+
+
+async def ensure_schema():
+    """Создаёт недостающие таблицы и колонки; вызывается при старте."""
+    async with connection() as conn:
+        await conn.execute(MIGRATE_PASSES_QUERY.query)
+        await conn.execute(CREATE_RANGE_PROGRESS_QUERY.query)
+
+
+async def get_range_progress(item: str) -> int | None:
+    """Последний номер диапазона item, до которого всё обработано, или None."""
+    async with connection() as conn:
+        my_named_parameter_conn = NamedParameterConnection(conn, GET_RANGE_PROGRESS_QUERY)
+        return await my_named_parameter_conn.fetchval(item=item)
+
+
+async def set_range_progress(item: str, done_upto: int):
+    async with connection() as conn:
+        my_named_parameter_conn = NamedParameterConnection(conn, UPSERT_RANGE_PROGRESS_QUERY)
+        return await my_named_parameter_conn.execute(item=item, done_upto=done_upto)
+
+
+async def delete_range_progress(item: str):
+    async with connection() as conn:
+        my_named_parameter_conn = NamedParameterConnection(conn, DELETE_RANGE_PROGRESS_QUERY)
+        return await my_named_parameter_conn.execute(item=item)
 
 
 async def test_get():
-    conn = await asyncpg.connect(DSN)
     query = 'SELECT * FROM tg.history WHERE path = {{PATH}} and "function" like {{FUNCTION}} order by asctime desc limit 50'
-    my_named_parameter_query = NamedParameterQuery(query)
-    my_named_parameter_conn = NamedParameterConnection(conn, my_named_parameter_query)
-    results = await my_named_parameter_conn.fetch(path='Сервис.ЕГТС.Эмулятор', function='send_%')
+    my_named_parameter_query = compile_query(query)
+    async with connection() as conn:
+        my_named_parameter_conn = NamedParameterConnection(conn, my_named_parameter_query)
+        results = await my_named_parameter_conn.fetch(path='Сервис.ЕГТС.Эмулятор', function='send_%')
     for result in results:
         print(result)
     return results
 
 
+async def _main():
+    try:
+        await get_account('nixncom@gmail.com')
+    finally:
+        await close_pool()
+
+
 if __name__ == '__main__':
-    asyncio.run(get_account('nixncom@gmail.com'))
\ No newline at end of file
+    asyncio.run(_main())
\ No newline at end of file
@@ -0,0 +1,90 @@
+import asyncio
+import collections
+import logging
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD-ограничитель одновременных запросов к API.
+
+    Пока ответы быстрые (не дольше latency_target) и доля ошибок мала, лимит растёт
+    примерно на increase за каждый "круг" из limit запросов; на 429/5xx/таймаут лимит
+    умножается на decrease. Retry-After приостанавливает выдачу новых слотов.
+    """
+
+    def __init__(self, initial: float, min_limit: float, max_limit: float, latency_target: float,
+                 increase: float = 1.0, decrease: float = 0.5, error_threshold: float = 0.05,
+                 ewma_alpha: float = 0.1, name: str = ''):
+        self._limit = float(initial)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.latency_target = latency_target
+        self.increase = increase
+        self.decrease = decrease
+        self.error_threshold = error_threshold
+        self.ewma_alpha = ewma_alpha
+        self.name = name
+        self.in_flight = 0
+        self.error_rate = 0.0
+        self.paused_until = 0.0
+        # Время последнего снижения: ответы на запросы, начатые раньше, лимит повторно не снижают
+        self._last_decrease = 0.0
+        self._waiters = collections.deque()
+
+    @property
+    def limit(self) -> int:
+        return max(1, int(self._limit))
+
+    async def acquire(self) -> float:
+        """Ждёт свободный слот; возвращает момент начала запроса для release."""
+        while True:
+            delay = self.paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            if self.in_flight < self.limit:
+                break
+            # Слотов нет - значит, есть запросы в работе, и release кого-нибудь разбудит
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif waiter.done() and not waiter.cancelled():
+                    # Разбудили, но задачу отменили раньше, чем она заняла слот: слот - следующему
+                    self._wake()
+                raise
+        self.in_flight += 1
+        return time.monotonic()
+
+    def _wake(self):
+        free = self.limit - self.in_flight
+        for waiter in list(self._waiters)[:max(free, 0)]:
+            self._waiters.remove(waiter)
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def release(self, started: float, overloaded: bool = False, retry_after: float | None = None):
+        """
+        overloaded - признак перегрузки (429, 5xx, таймаут),
+        retry_after - пауза из заголовка Retry-After, сек.
+        """
+        self.in_flight -= 1
+        now = time.monotonic()
+        self.error_rate += self.ewma_alpha * (overloaded - self.error_rate)
+        if overloaded:
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            if started >= self._last_decrease:
+                self._limit = max(self.min_limit, self._limit * self.decrease)
+                self._last_decrease = now
+                LOGGER.warning(f"{self.name}: перегрузка API, лимит снижен до {self.limit}")
+        elif now - started <= self.latency_target and self.error_rate < self.error_threshold:
+            self._limit = min(self.max_limit, self._limit + self.increase / self._limit)
+        # Разбуженные во время паузы Retry-After сами доспят её в acquire
+        self._wake()
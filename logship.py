@@ -0,0 +1,184 @@
+"""
+Доставка логов без задержек на горячем пути.
+
+install() ставит на логгер один QueueHandler: запись кладётся в ограниченную очередь,
+а консоль, файл и сборщик логов обслуживает фоновый QueueListener. BatchingHTTPHandler
+заменяет logging.handlers.HTTPHandler: копит записи в своей очереди и отправляет их
+пачками из отдельного потока по постоянному соединению. Если очередь полна (сборщик
+тормозит или недоступен), новые записи отбрасываются и считаются в DROPPED - поток
+обработки пропусков не ждёт никогда. SampleFilter оставляет долю записей уровня INFO
+и ниже, например от логгера поштучных результатов passes.lookups.
+
+Модуль не импортирует config и прочие модули проекта: он подключается из logging.json
+ещё до того, как config.py загрузится до конца.
+"""
+import atexit
+import collections
+import http.client
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+import time
+import urllib.parse
+
+# Сколько записей отброшено: 'queue' - переполнена общая очередь, 'http' - очередь
+# отправки, 'failed' - сборщик не принял пачку
+DROPPED = collections.Counter()
+
+
+def dropped(stage: str) -> int:
+    return DROPPED[stage]
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который при полной очереди отбрасывает запись, а не падает в handleError."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED['queue'] += 1
+
+
+class SampleFilter(logging.Filter):
+    """Пропускает долю rate записей уровня level и ниже; более важные - всегда."""
+
+    def __init__(self, rate: float = 1.0, level: int | str = logging.INFO, name: str = ''):
+        super().__init__(name)
+        self.rate = rate
+        self.level = logging._checkLevel(level)
+
+    def filter(self, record) -> bool:
+        if record.levelno > self.level or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+
+class BatchingHTTPHandler(logging.Handler):
+    """
+    Отправляет записи на http://host/url пачками до batch_size записей или раз в
+    flush_interval сек - JSON-массивом полей записей. При batch_size=1 каждая запись
+    уходит отдельно в формате logging.handlers.HTTPHandler (form-urlencoded) - так
+    настроено в logging.json, пока сборщик не принимает JSON-пачки.
+    """
+
+    def __init__(self, host: str, url: str, batch_size: int = 100, flush_interval: float = 1.0,
+                 queue_size: int = 10000, timeout: float = 5.0, level=logging.NOTSET):
+        super().__init__(level)
+        self.host = host
+        self.url = url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.queue = queue.Queue(queue_size)
+        self._connection = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='logship', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def emit(self, record):
+        try:
+            # Сообщение и исключение форматируются здесь: в потоке отправки аргументы уже могли измениться
+            record.formatted = self.format(record)
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED['http'] += 1
+        except Exception:
+            self.handleError(record)
+
+    def map_record(self, record) -> dict:
+        fields = dict(record.__dict__)
+        fields['msg'] = record.getMessage()
+        fields['args'] = None
+        fields['exc_info'] = None
+        return fields
+
+    @staticmethod
+    def map_log_record(record) -> dict:
+        # Поля в точности как у logging.handlers.HTTPHandler.mapLogRecord
+        fields = dict(record.__dict__)
+        fields.pop('formatted', None)
+        return fields
+
+    def _next_batch(self) -> list:
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _post(self, body: bytes, content_type: str):
+        for attempt in (1, 2):
+            if self._connection is None:
+                self._connection = http.client.HTTPConnection(self.host, timeout=self.timeout)
+            try:
+                self._connection.request('POST', self.url, body, {'Content-Type': content_type})
+                response = self._connection.getresponse()
+                response.read()
+                return response.status < 400
+            except (OSError, http.client.HTTPException):
+                # Разорванное постоянное соединение - один раз переподключаемся
+                self._connection.close()
+                self._connection = None
+                if attempt == 2:
+                    raise
+
+    def _send(self, batch: list):
+        try:
+            if self.batch_size == 1:
+                body = urllib.parse.urlencode(self.map_log_record(batch[0])).encode('utf-8')
+                delivered = self._post(body, 'application/x-www-form-urlencoded')
+            else:
+                body = json.dumps([self.map_record(record) for record in batch],
+                                  ensure_ascii=False, default=str).encode('utf-8')
+                delivered = self._post(body, 'application/json')
+        except Exception:
+            delivered = False
+        if not delivered:
+            DROPPED['failed'] += len(batch)
+
+    def _run(self):
+        while not (self._stopped.is_set() and self.queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._send(batch)
+
+    def close(self):
+        if not self._stopped.is_set():
+            self._stopped.set()
+            # Дожидаемся отправки накопленного, но не дольше одного таймаута
+            self._thread.join(self.timeout + self.flush_interval)
+            DROPPED['failed'] += self.queue.qsize()
+            if self._connection is not None:
+                self._connection.close()
+        super().close()
+
+
+def install(logger: logging.Logger | None = None, queue_size: int = 10000) -> logging.handlers.QueueListener:
+    """
+    Переносит обработчики логгера (по умолчанию корневого) за очередь: на логгере
+    остаётся один DroppingQueueHandler, а сами обработчики вызывает фоновый поток.
+    """
+    logger = logger or logging.getLogger()
+    handlers = list(logger.handlers)
+    log_queue = queue.Queue(queue_size)
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(DroppingQueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
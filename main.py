@@ -1,38 +1,170 @@
+import argparse
 import asyncio
+import datetime
+import itertools
 import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
 import time
 
+import aio_pika
 import pika
 from pika.exceptions import AMQPConnectionError
 
-from config import MQ
+from config import METRICS, MQ, RETRY
 import db
-from passes import MosPass
+import metrics
+import negindex
+import retry
+import workitems
+from accounts import AccountPool
+from records import PassRecord
 
 LOGGER = logging.getLogger(__name__)
-acc = asyncio.run(db.get_account('nixncom@gmail.com'))
-print(acc)
-username = acc[0]['login']
-password = acc[0]['password']
-PMOS = MosPass(username, password)
+# Один цикл событий на процесс: на нём живёт пул соединений db.py. Создаётся в init(),
+# а не при импорте - супервизор (--workers) не должен ни подключаться, ни грузить аккаунты
+LOOP = None
+# Активные аккаунты из passes.accounts: все или часть, отданная воркеру
+ACCOUNTS = None
+
+
+def init(usernames=None):
+    global LOOP, ACCOUNTS
+    LOOP = asyncio.new_event_loop()
+    asyncio.set_event_loop(LOOP)
+    ACCOUNTS = LOOP.run_until_complete(AccountPool().load(usernames))
+
+
+async def lookup(pass_no, refresh=False):
+    # Номер недавно подтверждённо отсутствовал - в API не ходим;
+    # refresh=True - мимо индекса и кэша аккаунтов
+    if not refresh and negindex.missing_recently(pass_no):
+        return None
+    return await ACCOUNTS.get_pass_info(pass_no, refresh)
 
 
 async def parse(pass_no):
-    stat = await PMOS.get_pass_info(pass_no)
+    item = workitems.parse_item(pass_no)
+    if item.is_range:
+        await parse_range(pass_no, item)
+        return
+    stat = await lookup(pass_no)
     if stat:
-        if isinstance(stat, dict):
+        if isinstance(stat, PassRecord):
             await db.set_pass(stat)
 
 
+async def parse_range(body: str, item: workitems.WorkItem):
+    """
+    Обрабатывает диапазон кусками по MQ.range_chunk номеров: номера куска запрашиваются
+    одновременно, найденные пишутся пачкой, после каждого куска сохраняется отметка
+    в passes.range_progress, чтобы после падения продолжить с неё, а не с начала.
+    """
+    LOGGER = logging.getLogger(__name__ + ".parse_range")
+    done_upto = await db.get_range_progress(body)
+    number = item.start if done_upto is None else done_upto + 1
+    if done_upto is not None:
+        LOGGER.info(f"{body}: продолжение с {workitems.format_pass(number, item.series)}")
+    passes = workitems.iter_passes(item, number)
+    while True:
+        chunk = list(itertools.islice(passes, MQ.range_chunk))
+        if not chunk:
+            break
+        results = await asyncio.gather(*[lookup(p) for p in chunk], return_exceptions=True)
+        failed = None
+        for i, result in enumerate(results):
+            if isinstance(result, BaseException):
+                failed = i
+                break
+        hits = [result for result in results if isinstance(result, PassRecord)]
+        if hits:
+            await db.set_passes(hits)
+        processed = len(chunk) if failed is None else failed
+        if processed:
+            await db.set_range_progress(body, number + processed - 1)
+        if failed is not None:
+            raise results[failed]
+        number += len(chunk)
+    await db.delete_range_progress(body)
+
+
+# Ошибки в самом сообщении (не разбирается номер, не та кодировка): повтор ничего не изменит
+POISON_ERRORS = (ValueError, KeyError, TypeError)
+# Сколько сообщений подряд вернулось в очередь; сбрасывается первым подтверждённым
+REQUEUES = 0
+
+
+def requeue_delay(error: Exception) -> float | None:
+    """
+    Пауза перед возвратом сообщения в очередь. None - сообщение не возвращается,
+    а отклоняется (reject без requeue) и уходит в dead-letter очередь, если она настроена.
+    """
+    global REQUEUES
+    if isinstance(error, POISON_ERRORS):
+        return None
+    if isinstance(error, retry.CircuitOpenError):
+        # Пока цепь разомкнута, сообщение придерживается до пробного запроса
+        delay = error.retry_in
+    else:
+        # Пауза по классу ошибки и растёт, пока сообщения возвращаются подряд
+        policy = retry.policy_for(error) or retry.RetryPolicy(None, *RETRY.requeue_delay)
+        delay = policy.delay(REQUEUES, error)
+    REQUEUES += 1
+    return max(delay, RETRY.min_requeue_delay)
+
+
+def acked():
+    global REQUEUES
+    REQUEUES = 0
+
+
+def observe_lag(timestamp):
+    # Время публикации ставит push_to_q: у aio-pika это datetime, у pika - unix-время
+    if timestamp is None:
+        return
+    if isinstance(timestamp, datetime.datetime):
+        timestamp = timestamp.timestamp()
+    metrics.CONSUMER_LAG.observe(max(0.0, time.time() - timestamp))
+
+
 def callback(ch, method, properties, body):
     LOGGER = logging.getLogger(__name__ + ".callback")
-    asyncio.run(parse(body.decode('utf-8')))
+    observe_lag(properties.timestamp)
+    metrics.CONSUMER_IN_FLIGHT.inc()
+    try:
+        LOOP.run_until_complete(parse(body.decode('utf-8')))
+    except Exception as e:
+        delay = requeue_delay(e)
+        if delay is None:
+            LOGGER.error(f"Сообщение {body!r} не обрабатывается: {e!r}. Сообщение отклонено")
+            ch.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
+            metrics.CONSUMER_MESSAGES.labels('reject').inc()
+            return
+        LOGGER.error(f"Ошибка обработки {body!r}: {e}. Сообщение возвращено в очередь через {delay:.0f} сек")
+        # sleep соединения pika продолжает обслуживать heartbeat
+        ch.connection.sleep(delay)
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        metrics.CONSUMER_MESSAGES.labels('nack').inc()
+        return
+    finally:
+        metrics.CONSUMER_IN_FLIGHT.dec()
     # Подтверждаем, что сообщение обработано
     ch.basic_ack(delivery_tag=method.delivery_tag)
+    metrics.CONSUMER_MESSAGES.labels('ack').inc()
+    acked()
+
+
+def reconnect_policy() -> retry.RetryPolicy:
+    return retry.RetryPolicy(None, *RETRY.reconnect_delay)
 
 
 def consume_messages():
     LOGGER = logging.getLogger(__name__ + ".consume_messages")
+    policy = reconnect_policy()
+    attempt = 0
     while True:
         try:
             # Установка соединения с RabbitMQ
@@ -46,6 +178,7 @@ def consume_messages():
 
             connection = pika.BlockingConnection(parameters)
             channel = connection.channel()
+            attempt = 0
 
             # Убедимся, что очередь существует
             #channel.queue_declare(queue=MQ.queue, durable=True)
@@ -57,12 +190,16 @@ def consume_messages():
             LOGGER.info("Ожидание сообщений. Для выхода нажмите CTRL+C")
             channel.start_consuming()
         except AMQPConnectionError as e:
-            LOGGER.error(f"Потеря соединения с RabbitMQ: {e}. Попытка переподключения через 5 секунд...",
+            delay = policy.delay(attempt)
+            LOGGER.error(f"Потеря соединения с RabbitMQ: {e}. Попытка переподключения через {delay:.0f} сек...",
                          exc_info=False)
-            time.sleep(5)
+            time.sleep(delay)
+            attempt += 1
         except Exception as e:
-            LOGGER.error(f"Произошла ошибка: {e}. Попытка переподключения через 5 секунд...", exc_info=False)
-            time.sleep(5)
+            delay = policy.delay(attempt)
+            LOGGER.error(f"Произошла ошибка: {e}. Попытка переподключения через {delay:.0f} сек...", exc_info=False)
+            time.sleep(delay)
+            attempt += 1
         finally:
             try:
                 connection.close()
@@ -70,5 +207,413 @@ def consume_messages():
                 pass
 
 
+async def handle_message(message: aio_pika.abc.AbstractIncomingMessage):
+    observe_lag(message.timestamp)
+    metrics.CONSUMER_IN_FLIGHT.inc()
+    try:
+        await parse(message.body.decode('utf-8'))
+    except Exception as e:
+        delay = requeue_delay(e)
+        if delay is None:
+            LOGGER.error(f"Сообщение {message.body!r} не обрабатывается: {e!r}. Сообщение отклонено")
+            await message.reject(requeue=False)
+            metrics.CONSUMER_MESSAGES.labels('reject').inc()
+            return
+        LOGGER.error(f"Ошибка обработки {message.body!r}: {e}. Сообщение возвращено в очередь через {delay:.0f} сек",
+                     exc_info=not isinstance(e, retry.CircuitOpenError))
+        await asyncio.sleep(delay)
+        await message.nack(requeue=True)
+        metrics.CONSUMER_MESSAGES.labels('nack').inc()
+    else:
+        # Подтверждаем только после того, как запись в БД завершилась
+        await message.ack()
+        metrics.CONSUMER_MESSAGES.labels('ack').inc()
+        acked()
+    finally:
+        metrics.CONSUMER_IN_FLIGHT.dec()
+
+
+async def consume_concurrently(channel: aio_pika.abc.AbstractChannel):
+    """До MQ.prefetch неподтверждённых сообщений и до MQ.concurrency одновременных parse."""
+    LOGGER = logging.getLogger(__name__ + ".consume_concurrently")
+    await channel.set_qos(prefetch_count=MQ.prefetch)
+    queue = await channel.get_queue(MQ.queue)
+
+    semaphore = asyncio.Semaphore(MQ.concurrency)
+    in_flight = set()
+
+    def on_done(task):
+        in_flight.discard(task)
+        semaphore.release()
+        if not task.cancelled() and task.exception() is not None:
+            LOGGER.error(f"Не удалось подтвердить сообщение: {task.exception()}")
+
+    LOGGER.info("Ожидание сообщений. Для выхода нажмите CTRL+C")
+    try:
+        async with queue.iterator() as queue_iter:
+            async for message in queue_iter:
+                await semaphore.acquire()
+                task = asyncio.create_task(handle_message(message))
+                in_flight.add(task)
+                task.add_done_callback(on_done)
+    finally:
+        # Даём начатым сообщениям дописаться и подтвердиться, пока канал жив
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
+
+async def resolve(body: bytes):
+    pass_no = body.decode('utf-8')
+    # Диапазоны обрабатываются и записываются целиком внутри parse_range
+    if workitems.parse_item(pass_no).is_range:
+        await parse(pass_no)
+        return None
+    return await lookup(pass_no)
+
+
+async def process_batch(messages: list):
+    """
+    Все номера пачки запрашиваются одновременно, найденные пропуска пишутся одним
+    db.set_passes, затем пачка подтверждается одним ack(multiple=True).
+    При ошибке подтверждается только обработанное начало пачки, хвост возвращается в очередь;
+    сообщения, которые не обрабатываются в принципе (requeue_delay - None), отклоняются.
+    """
+    for message in messages:
+        observe_lag(message.timestamp)
+    metrics.CONSUMER_IN_FLIGHT.inc(len(messages))
+    try:
+        return await _process_batch(messages)
+    finally:
+        metrics.CONSUMER_IN_FLIGHT.dec(len(messages))
+
+
+async def _process_batch(messages: list):
+    LOGGER = logging.getLogger(__name__ + ".process_batch")
+    results = await asyncio.gather(*[resolve(message.body) for message in messages], return_exceptions=True)
+
+    processed = len(messages)
+    delay = None
+    rejected = []
+    for i, result in enumerate(results):
+        if isinstance(result, BaseException):
+            delay = requeue_delay(result)
+            if delay is None:
+                LOGGER.error(f"Сообщение {messages[i].body!r} не обрабатывается: {result!r}. Сообщение отклонено")
+                rejected.append(i)
+                continue
+            LOGGER.error(f"Ошибка обработки {messages[i].body!r}: {result}")
+            processed = i
+            break
+
+    hits = [result for result in results[:processed] if isinstance(result, PassRecord)]
+    if hits:
+        try:
+            await db.set_passes(hits)
+        except Exception as e:
+            LOGGER.error(f"Ошибка пакетной записи {len(hits)} пропусков: {e}", exc_info=True)
+            processed = 0
+            rejected = []
+            # Какое из сообщений виновато, неизвестно: вся пачка возвращается в очередь
+            delay = requeue_delay(e) or RETRY.min_requeue_delay
+
+    for i in rejected:
+        await messages[i].reject(requeue=False)
+        metrics.CONSUMER_MESSAGES.labels('reject').inc()
+    # Пачки обрабатываются строго по одной, поэтому multiple=True
+    # не задевает сообщения других пачек; отклонённые уже не в их числе
+    acks = [i for i in range(processed) if i not in rejected]
+    if acks:
+        await messages[acks[-1]].ack(multiple=True)
+        metrics.CONSUMER_MESSAGES.labels('ack').inc(len(acks))
+        acked()
+    if processed < len(messages):
+        LOGGER.warning(f"Возвращено в очередь: {len(messages) - processed} из {len(messages)}")
+        await asyncio.sleep(delay)
+        await messages[-1].nack(multiple=True, requeue=True)
+        metrics.CONSUMER_MESSAGES.labels('nack').inc(len(messages) - processed)
+    return processed
+
+
+async def consume_batches(channel: aio_pika.abc.AbstractChannel):
+    """Собирает до MQ.batch_size сообщений или ждёт не дольше MQ.batch_timeout мс."""
+    LOGGER = logging.getLogger(__name__ + ".consume_batches")
+    await channel.set_qos(prefetch_count=max(MQ.prefetch, MQ.batch_size))
+    queue = await channel.get_queue(MQ.queue)
+
+    # None в очереди - признак закрытия канала
+    inbox = asyncio.Queue()
+    channel.close_callbacks.add(lambda *args: inbox.put_nowait(None))
+    await queue.consume(inbox.put)
+
+    loop = asyncio.get_running_loop()
+    LOGGER.info("Ожидание сообщений. Для выхода нажмите CTRL+C")
+    while True:
+        message = await inbox.get()
+        if message is None:
+            return
+        batch = [message]
+        deadline = loop.time() + MQ.batch_timeout / 1000
+        while len(batch) < MQ.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                message = await asyncio.wait_for(inbox.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if message is None:
+                # Канал закрыт: неподтверждённые сообщения брокер вернёт в очередь сам
+                return
+            batch.append(message)
+        await process_batch(batch)
+
+
+async def consume_messages_async(batch=False):
+    """Асинхронный потребитель: один цикл событий на процесс, переподключение при обрыве."""
+    LOGGER = logging.getLogger(__name__ + ".consume_messages_async")
+    policy = reconnect_policy()
+    attempt = 0
+    while True:
+        try:
+            connection = await aio_pika.connect(
+                host=MQ.host,
+                port=MQ.port,
+                login=MQ.user,
+                password=MQ.password,
+                virtualhost=MQ.vhost
+            )
+            async with connection:
+                channel = await connection.channel()
+                attempt = 0
+                if batch:
+                    await consume_batches(channel)
+                else:
+                    await consume_concurrently(channel)
+        except aio_pika.exceptions.AMQPConnectionError as e:
+            delay = policy.delay(attempt)
+            LOGGER.error(f"Потеря соединения с RabbitMQ: {e}. Попытка переподключения через {delay:.0f} сек...",
+                         exc_info=False)
+            await asyncio.sleep(delay)
+            attempt += 1
+        except Exception as e:
+            delay = policy.delay(attempt)
+            LOGGER.error(f"Произошла ошибка: {e}. Попытка переподключения через {delay:.0f} сек...", exc_info=False)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def run(args, usernames=None, stats=None, worker=None):
+    """
+    Потребитель в текущем процессе. Без stats - обычный одиночный запуск: сам отдаёт
+    /metrics и проверяет схему базы. Воркер супервизора получает свою часть аккаунтов
+    usernames и раз в MQ.stats_interval сек кладёт снимок метрик в очередь stats.
+    """
+    MQ.prefetch = args.prefetch
+    MQ.concurrency = args.concurrency
+    MQ.batch_size = args.batch_size
+    MQ.batch_timeout = args.batch_timeout
+    stop_reporting = threading.Event()
+    if stats is None:
+        metrics.serve(port=args.metrics_port)
+    else:
+        # Отдельный поток: в режиме blocking цикл событий между сообщениями стоит
+        def report():
+            while not stop_reporting.wait(MQ.stats_interval):
+                stats.put((worker, os.getpid(), metrics.snapshot()))
+        threading.Thread(target=report, name='stats', daemon=True).start()
+    try:
+        init(usernames)
+        if stats is None:
+            LOOP.run_until_complete(db.ensure_schema())
+        if args.mode in ('async', 'batch'):
+            LOOP.run_until_complete(consume_messages_async(batch=args.mode == 'batch'))
+        else:
+            consume_messages()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_reporting.set()
+        if ACCOUNTS is not None:
+            LOOP.run_until_complete(ACCOUNTS.close())
+        if LOOP is not None:
+            LOOP.run_until_complete(db.close_pool())
+            LOOP.close()
+        negindex.close()
+        if stats is not None:
+            stats.put((worker, os.getpid(), metrics.snapshot()))
+
+
+def _interrupt(signum, frame):
+    # Повторный сигнал (Ctrl+C доходит и до воркеров, а супервизор ещё шлёт SIGTERM)
+    # не должен прерывать закрытие соединений
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
+
+def worker(index: int, usernames: list, args, stats):
+    """Точка входа процесса-воркера: свой цикл событий, свой пул соединений, свои аккаунты."""
+    signal.signal(signal.SIGTERM, _interrupt)
+    signal.signal(signal.SIGINT, _interrupt)
+    LOGGER.info(f"Воркер {index}: аккаунты {', '.join(usernames)}")
+    run(args, usernames, stats, index)
+
+
+async def _prepare_workers() -> list:
+    try:
+        await db.ensure_schema()
+        return sorted(row['login'] for row in await db.get_account() if row['active'])
+    finally:
+        await db.close_pool()
+
+
+def _value(metric, *values) -> float:
+    child = metric._children.get(values)
+    return child.value if child is not None else 0
+
+
+class Supervisor:
+    """
+    Запускает воркеры в отдельных процессах, перезапускает упавшие и собирает их метрики.
+    Аккаунты делятся между воркерами по кругу, prefetch и concurrency - поровну,
+    так что на брокер и API вся группа даёт ту же нагрузку, что и один процесс.
+    """
+
+    def __init__(self, args, workers: int):
+        self.args = args
+        # spawn, а не fork: потоки логирования и метрик при fork в дочерний процесс не переходят
+        self.context = multiprocessing.get_context('spawn')
+        self.stats = self.context.Queue()
+        logins = asyncio.run(_prepare_workers())
+        if not logins:
+            raise RuntimeError('В passes.accounts нет активных аккаунтов')
+        if workers > len(logins):
+            LOGGER.warning(f"Воркеров {workers}, а активных аккаунтов {len(logins)}: "
+                           f"запускается {len(logins)}")
+            workers = len(logins)
+        self.accounts = [logins[i::workers] for i in range(workers)]
+        self.worker_args = argparse.Namespace(**vars(args))
+        self.worker_args.prefetch = max(1, args.prefetch // workers)
+        self.worker_args.concurrency = max(1, args.concurrency // workers)
+        self.processes = [None] * workers
+        self.started_at = [0.0] * workers
+        self.restart_at = [0.0] * workers
+        self.failures = [0] * workers
+        self.policy = reconnect_policy()
+        # Последние снимки метрик работающих воркеров и итоговые - завершившихся
+        self.snapshots = {}
+        self.finished = []
+        self._acked = 0
+        self._reported_at = time.monotonic()
+
+    def start(self, index: int):
+        process = self.context.Process(target=worker, name=f'worker-{index}', daemon=True,
+                                       args=(index, self.accounts[index], self.worker_args, self.stats))
+        process.start()
+        self.processes[index] = process
+        self.started_at[index] = time.monotonic()
+
+    def collect(self, timeout: float):
+        try:
+            message = self.stats.get(timeout=timeout)
+            while True:
+                index, pid, snapshot = message
+                # Последний снимок упавшего воркера может прийти уже после его перезапуска
+                process = self.processes[index]
+                if process is not None and process.pid == pid:
+                    self.snapshots[index] = snapshot
+                message = self.stats.get_nowait()
+        except queue.Empty:
+            pass
+
+    def check(self):
+        now = time.monotonic()
+        for index, process in enumerate(self.processes):
+            if process is None:
+                if now >= self.restart_at[index]:
+                    LOGGER.info(f"Перезапуск воркера {index}")
+                    self.start(index)
+                continue
+            if process.is_alive():
+                continue
+            if now - self.started_at[index] < MQ.worker_min_uptime:
+                self.failures[index] += 1
+            else:
+                self.failures[index] = 0
+            delay = self.policy.delay(self.failures[index])
+            LOGGER.error(f"Воркер {index} завершился с кодом {process.exitcode}. "
+                         f"Перезапуск через {delay:.0f} сек...")
+            process.close()
+            self.processes[index] = None
+            self.restart_at[index] = now + delay
+            snapshot = self.snapshots.pop(index, None)
+            if snapshot is not None:
+                self.finished.append(snapshot)
+
+    def report(self):
+        metrics.merge(list(self.snapshots.values()), self.finished)
+        acked = _value(metrics.CONSUMER_MESSAGES, 'ack')
+        now = time.monotonic()
+        rate = (acked - self._acked) / (now - self._reported_at)
+        self._acked, self._reported_at = acked, now
+        alive = sum(1 for process in self.processes if process is not None)
+        LOGGER.info(f"Воркеров {alive}/{len(self.processes)}: подтверждено {acked:.0f} (+{rate:.1f}/сек), "
+                    f"возвращено {_value(metrics.CONSUMER_MESSAGES, 'nack'):.0f}, "
+                    f"в обработке {_value(metrics.CONSUMER_IN_FLIGHT):.0f}")
+
+    def stop(self, timeout: float = 30):
+        running = [process for process in self.processes if process is not None]
+        for process in running:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in running:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                LOGGER.warning(f"{process.name} не завершился за {timeout} сек")
+                process.kill()
+                process.join()
+
+    def run(self):
+        LOGGER.info(f"Запуск воркеров: {len(self.processes)}, prefetch {self.worker_args.prefetch}, "
+                    f"concurrency {self.worker_args.concurrency} на воркер")
+        metrics.serve(port=self.args.metrics_port)
+        signal.signal(signal.SIGTERM, _interrupt)
+        try:
+            for index in range(len(self.processes)):
+                self.start(index)
+            next_report = time.monotonic() + MQ.stats_interval
+            while True:
+                self.collect(timeout=1)
+                self.check()
+                if time.monotonic() >= next_report:
+                    self.report()
+                    next_report += MQ.stats_interval
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Обработчик очереди пропусков')
+    parser.add_argument('--mode', choices=['async', 'batch', 'blocking'], default=MQ.consumer_mode,
+                        help='async - один цикл событий и параллельная обработка, '
+                             'batch - пачками с пакетной записью, blocking - по одному сообщению')
+    parser.add_argument('--prefetch', type=int, default=MQ.prefetch)
+    parser.add_argument('--concurrency', type=int, default=MQ.concurrency)
+    parser.add_argument('--batch-size', type=int, default=MQ.batch_size)
+    parser.add_argument('--batch-timeout', type=int, default=MQ.batch_timeout, help='мс')
+    parser.add_argument('--metrics-port', type=int, default=METRICS.port,
+                        help='порт /metrics; у каждого процесса на одной машине должен быть свой')
+    parser.add_argument('--workers', type=int, default=MQ.workers,
+                        help='процессов-потребителей; больше 1 - под управлением супервизора')
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    consume_messages()
+    args = parse_args()
+    if args.workers > 1:
+        Supervisor(args, args.workers).run()
+    else:
+        run(args)
@@ -0,0 +1,266 @@
+"""
+Метрики процесса в текстовом формате Prometheus.
+
+Счётчики, значения и гистограммы - обычные числа в словарях без блокировок:
+пишет их цикл событий, а HTTP-поток (serve) только читает, так что на горячем пути
+остаётся поиск по словарю и сложение. Отдельные значения в одном ответе могут
+разойтись на одно-два наблюдения - для метрик это допустимо.
+"""
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import logship
+from config import METRICS
+
+LOGGER = logging.getLogger(__name__)
+
+# Секунды: от быстрых ответов API и записей в базу до зависших запросов
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_METRICS = []
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in (*zip(names, values), *extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        _METRICS.append(self)
+
+    def labels(self, *values):
+        """Дочерняя метрика для набора значений меток; её стоит сохранить и переиспользовать."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name}: ожидались метки {self.labelnames}')
+            child = self._children[values] = self._child()
+        return child
+
+    def _child(self):
+        raise NotImplementedError
+
+    def set_function(self, function, *values):
+        """Значение для набора меток берётся из function() в момент выдачи метрик."""
+        self._children[values] = _FunctionValue(function)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            yield from child.samples(self.name, self.labelnames, values)
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+    def add(self, data):
+        self.value += data
+
+    def samples(self, name, labelnames, values):
+        yield f'{name}{_format_labels(labelnames, values)} {_format_value(self.value)}'
+
+
+class _FunctionValue:
+    __slots__ = ('function',)
+
+    def __init__(self, function):
+        self.function = function
+
+    def snapshot(self):
+        return self.function()
+
+    def samples(self, name, labelnames, values):
+        yield f'{name}{_format_labels(labelnames, values)} {_format_value(self.function())}'
+
+
+class Counter(_Metric):
+    kind = 'counter'
+    _child = _Value
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+    _child = _Value
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class _Observations:
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def snapshot(self):
+        return list(self.counts), self.sum
+
+    def add(self, data):
+        counts, total = data
+        for i, count in enumerate(counts):
+            self.counts[i] += count
+        self.sum += total
+
+    def samples(self, name, labelnames, values):
+        total = 0
+        for bound, count in zip((*self.buckets, float('inf')), self.counts):
+            total += count
+            le = (('le', _format_value(float(bound))),)
+            yield f'{name}_bucket{_format_labels(labelnames, values, le)} {total}'
+        yield f'{name}_sum{_format_labels(labelnames, values)} {_format_value(self.sum)}'
+        yield f'{name}_count{_format_labels(labelnames, values)} {total}'
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _child(self):
+        return _Observations(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+
+def snapshot() -> dict:
+    """Значения всех метрик процесса простыми типами - чтобы передать их в другой процесс."""
+    return {metric.name: {values: child.snapshot() for values, child in list(metric._children.items())}
+            for metric in _METRICS}
+
+
+def merge(snapshots, finished=()):
+    """
+    Заменяет значения метрик суммой снимков snapshot() других процессов - так супервизор
+    main.py отдаёт метрики своих воркеров. finished - снимки завершившихся процессов:
+    их счётчики и гистограммы продолжают учитываться, а значения Gauge - нет.
+    """
+    for metric in _METRICS:
+        children = {}
+        for snapshot_ in (*snapshots, *(() if metric.kind == 'gauge' else finished)):
+            for values, data in snapshot_.get(metric.name, {}).items():
+                child = children.get(values)
+                if child is None:
+                    child = children[values] = metric._child()
+                child.add(data)
+        metric._children = children
+
+
+def render() -> str:
+    return '\n'.join(metric.render() for metric in _METRICS) + '\n'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host: str | None = None, port: int | None = None) -> ThreadingHTTPServer | None:
+    """
+    Отдаёт /metrics из фонового потока; без METRICS.enabled ничего не делает.
+    Занятый порт (второй процесс на той же машине) - не повод не запускаться:
+    ошибка пишется в лог, процесс работает без /metrics.
+    """
+    if not METRICS.enabled:
+        return None
+    host = host or METRICS.host
+    port = METRICS.port if port is None else port
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        LOGGER.error(f'Метрики не запущены: {host}:{port} - {e}')
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    LOGGER.info(f'Метрики: http://{server.server_address[0]}:{server.server_address[1]}/metrics')
+    return server
+
+
+# Запросы к API (passes.MosPass)
+API_REQUESTS = Counter('mospass_requests_total', 'Ответы API по аккаунту и статусу', ('account', 'status'))
+API_LATENCY = Histogram('mospass_request_seconds', 'Время запроса к API', ('account',))
+API_AUTH = Counter('mospass_auth_total', 'Повторные авторизации аккаунта', ('account',))
+
+# Запись в базу (db.py)
+DB_WRITE_LATENCY = Histogram('db_write_seconds', 'Время записи в базу', ('operation',))
+DB_PASSES = Counter('db_passes_total', 'Пропуски, пришедшие на запись', ('result',))
+
+# Потребитель очереди (main.py)
+CONSUMER_IN_FLIGHT = Gauge('consumer_in_flight', 'Сообщения в обработке')
+CONSUMER_MESSAGES = Counter('consumer_messages_total', 'Обработанные сообщения', ('result',))
+CONSUMER_LAG = Histogram('consumer_lag_seconds', 'Время от публикации сообщения до начала обработки',
+                         buckets=(1, 5, 15, 60, 300, 900, 3600, 4 * 3600, 24 * 3600))
+
+# Кэш поиска пропусков (cache.py)
+LOOKUP_CACHE = Counter('lookup_cache_total', 'Обращения к кэшу поиска пропусков', ('result',))
+
+# Доставка логов (logship.py)
+LOG_DROPPED = Counter('log_records_dropped_total', 'Отброшенные записи логов', ('stage',))
+for _stage in ('queue', 'http', 'failed'):
+    LOG_DROPPED.set_function(lambda stage=_stage: logship.dropped(stage), _stage)
@@ -0,0 +1,147 @@
+"""
+Индекс номеров пропусков, которых подтверждённо нет (API ответил 404/400).
+
+На каждую серию - файл NEGINDEX.path/<серия в hex>.u32: массив uint32, где ячейка с
+индексом номера хранит время (unix, сек) последнего ответа "не существует", 0 - нет
+сведений или пропуск найден. Ячейка 0 хранит наибольший найденный номер серии: номера
+выше него, скорее всего, просто ещё не выданы, поэтому в индекс не попадают.
+Файлы отображаются в память (mmap, MAP_SHARED), так что воркеры разных процессов
+видят отметки друг друга сразу; растут кусками по NEGINDEX.grow_by номеров.
+"""
+import fcntl
+import mmap
+import os
+import time
+
+from config import NEGINDEX
+from workitems import parse_item
+
+ITEM_SIZE = 4  # uint32
+HIGH_WATER = 0
+
+
+class SeriesIndex:
+    def __init__(self, path: str, grow_by: int):
+        self.path = path
+        self.grow_by = grow_by
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._mmap = None
+        self._slots = None
+        self._remap(max(os.fstat(self._fd).st_size, grow_by * ITEM_SIZE))
+
+    def _remap(self, size: int):
+        if os.fstat(self._fd).st_size < size:
+            # Файл только растёт; блокировка - чтобы другой процесс не "урезал" его обратно
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._fd).st_size < size:
+                    os.ftruncate(self._fd, size)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._release()
+        self._mmap = mmap.mmap(self._fd, os.fstat(self._fd).st_size)
+        self._slots = memoryview(self._mmap).cast('I')
+
+    def _release(self):
+        if self._slots is not None:
+            self._slots.release()
+            self._mmap.close()
+            self._slots = self._mmap = None
+
+    def _fits(self, number: int, grow: bool = False) -> bool:
+        if number < len(self._slots):
+            return True
+        # Файл мог вырасти в другом процессе
+        size = os.fstat(self._fd).st_size
+        if grow:
+            size = max(size, (number // self.grow_by + 1) * self.grow_by * ITEM_SIZE)
+        if size // ITEM_SIZE <= number:
+            return False
+        self._remap(size)
+        return True
+
+    @property
+    def high_water(self) -> int:
+        return self._slots[HIGH_WATER]
+
+    def checked_at(self, number: int) -> int:
+        """Когда номер последний раз оказался несуществующим (unix, сек), 0 - нет сведений."""
+        return self._slots[number] if self._fits(number) else 0
+
+    def missing_recently(self, number: int, ttl: float, now: float | None = None) -> bool:
+        checked_at = self.checked_at(number)
+        return bool(checked_at) and (now or time.time()) - checked_at < ttl
+
+    def count_missing(self, start: int, stop: int, ttl: float) -> int:
+        """Сколько номеров [start, stop] недавно подтверждённо отсутствовали."""
+        if not self._fits(stop):
+            stop = len(self._slots) - 1
+        if stop < start:
+            return 0
+        since = time.time() - ttl
+        return sum(1 for checked_at in self._slots[start:stop + 1] if checked_at > since)
+
+    def mark_missing(self, number: int, when: float | None = None) -> bool:
+        if number >= self.high_water:
+            return False
+        self._fits(number, grow=True)
+        self._slots[number] = int(when or time.time())
+        return True
+
+    def mark_found(self, number: int):
+        self._fits(number, grow=True)
+        if self._slots[number]:
+            self._slots[number] = 0
+        if number > self._slots[HIGH_WATER]:
+            self._slots[HIGH_WATER] = number
+
+    def close(self):
+        self._release()
+        os.close(self._fd)
+
+
+_INDEXES = {}
+
+
+def index(series: str) -> SeriesIndex:
+    series_index = _INDEXES.get(series)
+    if series_index is None:
+        os.makedirs(NEGINDEX.path, exist_ok=True)
+        path = os.path.join(NEGINDEX.path, f'{series.encode("utf-8").hex()}.u32')
+        series_index = _INDEXES[series] = SeriesIndex(path, NEGINDEX.grow_by)
+    return series_index
+
+
+def missing_recently(pass_no: str, ttl: float | None = None) -> bool:
+    """Номер недавно подтверждённо отсутствовал - запрашивать его снова незачем."""
+    if not NEGINDEX.enabled:
+        return False
+    item = parse_item(pass_no)
+    return index(item.series).missing_recently(item.start, NEGINDEX.ttl if ttl is None else ttl)
+
+
+def record(pass_no: str, found: bool):
+    """Запоминает ответ API по номеру: found=False - только для ответа 404/400."""
+    if not NEGINDEX.enabled:
+        return
+    item = parse_item(pass_no)
+    if found:
+        index(item.series).mark_found(item.start)
+    else:
+        index(item.series).mark_missing(item.start)
+
+
+def skip_missing(items, ttl: float | None = None):
+    """Пропускает элементы очереди, все номера которых недавно подтверждённо отсутствовали."""
+    ttl = NEGINDEX.ttl if ttl is None else ttl
+    for body in items:
+        if NEGINDEX.enabled:
+            item = parse_item(body)
+            if index(item.series).count_missing(item.start, item.stop, ttl) == len(item):
+                continue
+        yield body
+
+
+def close():
+    while _INDEXES:
+        _INDEXES.popitem()[1].close()
@@ -1,16 +1,26 @@
 import asyncio
+import email.utils
 import logging
 import subprocess
-import sys
+import time
 import traceback
 from pathlib import Path
-import requests
+import aiohttp
 # from auth import AuthEMU
 import warnings
 import db
 import config
+import metrics
+import retry
+from limiter import AdaptiveLimiter
+from records import PassRecord
+from retry import Unauthorized, UnexpectedStatus, UpstreamError
 
 LOGGER = logging.getLogger(__name__)
+# Поштучные результаты запросов: в logging.json на него стоит выборочный фильтр
+LOOKUP_LOGGER = logging.getLogger(__name__ + '.lookups')
+# Ответы, после которых запрос повторяется позже (UpstreamError), кроме 5xx
+UPSTREAM_STATUSES = (403, 408, 429)
 warnings.filterwarnings("ignore")
 
 Path('sql').mkdir(exist_ok=True)
@@ -19,139 +29,359 @@ Path('sql').mkdir(exist_ok=True)
 # Path('../fails').mkdir(exist_ok=True)
 
 
+HEADERS = {
+    "Sec-Ch-Ua": "\"Not/A)Brand\";v=\"8\", \"Chromium\";v=\"126\"",
+    "Accept": "application/json",
+    "Accept-Language": "ru-RU",
+    "Sec-Ch-Ua-Mobile": "?0",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.6478.127 Safari/537.36",
+    "Sec-Ch-Ua-Platform": "\"macOS\"",
+    "Sec-Fetch-Site": "same-origin",
+    "Sec-Fetch-Mode": "cors",
+    "Sec-Fetch-Dest": "empty",
+    "Referer": "https://lk.ovga.mos.ru/vehicle-pass-requests/create",
+    "Priority": "u=1, i",
+    "Connection": "keep-alive"
+}
+
+
 def run_command(command):
     std = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     return std.stdout.decode()
 
 
-def docker_run(image, env: dict | None = None, command: str | None = None, autoremove_container=True):
+async def run_command_async(command, timeout=None):
+    proc = await asyncio.create_subprocess_shell(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise
+    return stdout.decode()
+
+
+def docker_command(image, env: dict | None = None, command: str | None = None, autoremove_container=True,
+                   redact=False):
+    # redact=True - для журнала: в env пароль аккаунта и строка подключения к базе
     s = 'docker run '
     if env:
         for e in env:
-            s += f'-e {e}=\'{env[e]}\' '
+            s += f'-e {e}=\'{"***" if redact else env[e]}\' '
     if autoremove_container:
         s += f'--network p_net --rm {image}'
     else:
         s += f'--network p_net {image}'
     if command:
         s += f' {command}'
-    print(s)
+    return s
+
+
+def docker_run(image, env: dict | None = None, command: str | None = None, autoremove_container=True):
+    s = docker_command(image, env, command, autoremove_container)
+    LOGGER.debug(docker_command(image, env, command, autoremove_container, redact=True))
     res = run_command(s)
     return res
 
 
+async def docker_run_async(image, env: dict | None = None, command: str | None = None, autoremove_container=True,
+                           timeout=None):
+    s = docker_command(image, env, command, autoremove_container)
+    LOGGER.debug(docker_command(image, env, command, autoremove_container, redact=True))
+    return await run_command_async(s, timeout)
+
+
 class MosPass:
-    def __init__(self, username, password):
+    def __init__(self, username, password, cookie_value=None, proxies=None):
         self.total_passed = 0
-        self.fails = 0
         self.username = username
         self.password = password
-        self.session = requests.Session()
+        # aiohttp-сессия привязана к циклу событий, создаётся при первом запросе
+        self.session = None
+        self._session_loop = None
+        # Число одновременных запросов аккаунта подстраивается под ответы API (AIMD)
+        self.limiter = AdaptiveLimiter(
+            initial=config.API.initial_concurrency,
+            min_limit=config.API.min_concurrency,
+            max_limit=config.API.concurrency,
+            latency_target=config.API.latency_target,
+            decrease=config.API.backoff,
+            name=username
+        )
+        self._latency = metrics.API_LATENCY.labels(username)
+        # proxies.ProxyPool или None - запросы идут напрямую
+        self.proxies = proxies
+        # Цепи: этого аккаунта и общая для адреса API
+        self.breakers = {
+            'account': retry.breaker(f'account:{username}'),
+            'endpoint': retry.breaker(f'endpoint:{config.API.url}')
+        }
+        # Если куки не переданы, они загружаются из passes.accounts при первом запросе
+        # (load_cookies), чтобы конструктор можно было вызывать и внутри работающего цикла событий
+        self.cookies = {".AspNetCore.Cookies": cookie_value} if cookie_value else None
+        # Пока идёт авторизация, AccountPool не выдаёт этот аккаунт
+        self.authenticating = False
+        # Единственная на аккаунт задача авторизации, её ждут все одновременные вызовы
+        self._auth_task = None
+        # Когда истекают куки (time.time()), если известно
+        self.cookies_expire_at = None
+        # Куки от последней авторизации, пока с ними не прошёл ни один запрос
+        self._fresh_cookies = None
+        if self.cookies and config.API.cookie_ttl:
+            self.cookies_expire_at = time.time() + config.API.cookie_ttl
+
+    async def load_cookies(self):
         try:
-            cv = asyncio.run(db.get_account(username))[0]['cookie_value']
+            cv = (await db.get_account(self.username))[0]['cookie_value']
             if cv:
-                print(cv)
-                self.cookies = {
-                    ".AspNetCore.Cookies": cv
-                }
+                self._set_cookie(cv)
             else:
-                asyncio.run(self.auth())
+                await self.auth()
         except Exception as e:
             traceback.print_exc()
             self.cookies = None
 
-    async def auth(self):
-        cv = docker_run(
-            image=config.AUTH_IMAGE,
-            autoremove_container=False,
-            env={
-                'USERNAME': self.username,
-                'PASSWORD': self.password,
-                'DSN': config.dockerDSN
-            }
-        )
+    def _set_cookie(self, cv, expire_at=None):
+        self.cookies = {
+            ".AspNetCore.Cookies": cv
+        }
+        if expire_at is None and config.API.cookie_ttl:
+            expire_at = time.time() + config.API.cookie_ttl
+        self.cookies_expire_at = expire_at
+
+    async def auth(self, background=False):
+        """
+        Переавторизация в одном экземпляре на аккаунт: если она уже идёт, вызов ждёт её
+        завершения, а не запускает ещё один контейнер. background=True - упреждающее
+        обновление действующих куки, аккаунт при этом остаётся в ротации.
+        Возвращает True, если авторизацию запустил этот вызов.
+        """
+        started = self._auth_task is None or self._auth_task.done()
+        if started:
+            self._auth_task = asyncio.ensure_future(self._auth(background))
+        if not background:
+            self.authenticating = True
+        await asyncio.shield(self._auth_task)
+        return started
+
+    async def _auth(self, background):
+        metrics.API_AUTH.labels(self.username).inc()
         try:
-            cv = await db.get_account(self.username)
-            cv = cv[0]['cookie_value']
-            self.cookies = {
-                ".AspNetCore.Cookies": cv
-            }
+            await docker_run_async(
+                image=config.AUTH_IMAGE,
+                autoremove_container=False,
+                env={
+                    'USERNAME': self.username,
+                    'PASSWORD': self.password,
+                    'DSN': config.dockerDSN
+                },
+                timeout=config.AUTH_TIMEOUT
+            )
+            try:
+                cv = await db.get_account(self.username)
+                cv = cv[0]['cookie_value']
+                self._set_cookie(cv)
+                self._fresh_cookies = self.cookies
+            except Exception as e:
+                traceback.print_exc()
         except Exception as e:
-            traceback.print_exc()
+            LOGGER.error(f"Ошибка авторизации {self.username}: {e}")
+        finally:
+            self.authenticating = False
 
-    async def get_pass_info(self, pass_no: str) -> dict | None:
-        print(pass_no)
-        headers = {
-            "Sec-Ch-Ua": "\"Not/A)Brand\";v=\"8\", \"Chromium\";v=\"126\"",
-            "Accept": "application/json",
-            "Accept-Language": "ru-RU",
-            "Sec-Ch-Ua-Mobile": "?0",
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.6478.127 Safari/537.36",
-            "Sec-Ch-Ua-Platform": "\"macOS\"",
-            "Sec-Fetch-Site": "same-origin",
-            "Sec-Fetch-Mode": "cors",
-            "Sec-Fetch-Dest": "empty",
-            "Referer": "https://lk.ovga.mos.ru/vehicle-pass-requests/create",
-            "Accept-Encoding": "gzip, deflate, br",
-            "Priority": "u=1, i",
-            "Connection": "keep-alive"
-        }
+    def _refresh_if_expiring(self):
+        if self.cookies_expire_at is None:
+            return
+        if time.time() < self.cookies_expire_at - config.API.cookie_refresh_margin:
+            return
+        if self._auth_task is None or self._auth_task.done():
+            LOGGER.info(f"Куки {self.username} скоро истекают, обновляем заранее")
+            self._auth_task = asyncio.ensure_future(self._auth(True))
+
+    async def _renew_cookie(self, morsel):
+        # Сервер продлил куки (скользящее истечение): берём новое значение и срок
+        expire_at = None
+        if morsel['max-age']:
+            expire_at = time.time() + int(morsel['max-age'])
+        elif morsel['expires']:
+            expire_at = email.utils.parsedate_to_datetime(morsel['expires']).timestamp()
+        if morsel.value == self.cookies[".AspNetCore.Cookies"]:
+            if expire_at is not None:
+                self.cookies_expire_at = expire_at
+            return
+        self._set_cookie(morsel.value, expire_at)
+        try:
+            await db.set_account(self.username, self.password, morsel.value)
+        except Exception as e:
+            LOGGER.error(f"Не удалось сохранить куки {self.username}: {e}")
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self.session is None or self.session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=config.API.pool_size,
+                keepalive_timeout=config.API.keepalive_timeout,
+                ssl=False
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                headers=HEADERS,
+                timeout=aiohttp.ClientTimeout(total=config.API.timeout),
+                # Куки аккаунта передаются явно из self.cookies
+                cookie_jar=aiohttp.DummyCookieJar()
+            )
+            self._session_loop = loop
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    @staticmethod
+    def _retry_after(value: str | None) -> float | None:
+        # Retry-After: число секунд или HTTP-дата
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    @classmethod
+    async def _request(cls, session, params, cookies, proxy=None):
+        res = None
+        async with session.get(config.API.url, params=params, cookies=cookies, proxy=proxy) as r:
+            status = r.status
+            # print(r.url)
+            # print(status)
+            # print(r.headers)
+            if status == 200:
+                res = await r.json(content_type=None)
+            renewed = r.cookies.get(".AspNetCore.Cookies")
+            retry_after = cls._retry_after(r.headers.get('Retry-After'))
+        return status, res, renewed, retry_after
+
+    async def _send(self, proxy, params, cookies):
+        if proxy is None:
+            return await self._request(self._get_session(), params, cookies)
+        proxy_session = proxy.get_session()
+        async with proxy.semaphore:
+            proxy.in_flight += 1
+            started = time.monotonic()
+            try:
+                result = await self._request(proxy_session, params, cookies, proxy.url)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                proxy.record(None, time.monotonic() - started)
+                raise
+            finally:
+                proxy.in_flight -= 1
+            proxy.record(result[0], time.monotonic() - started)
+        return result
+
+    async def get_pass_info(self, pass_no: str) -> PassRecord | None:
+        """
+        Найденный пропуск - PassRecord, несуществующий (404/400) - None;
+        на любой другой ответ - исключение.
+        Повторы по политикам retry.policy_for; если цепь аккаунта или API разомкнута,
+        сразу выбрасывает retry.CircuitOpenError.
+        """
+        return await retry.call(self._get_pass_info, pass_no, breakers=self.breakers)
+
+    async def _get_pass_info(self, pass_no: str) -> PassRecord | None:
         params = {
             "SeriesAndNumber": pass_no.replace(" ", "")
         }
         if not self.cookies:
             # sys.exit(1)
-            await self.auth()
-        r = self.session.get(
-            url=f"https://lk.ovga.mos.ru/api/Pass/GetPassBySeriesAndNumber",
-            params=params,
-            headers=headers,
-            cookies=self.cookies,
-            verify=False
-        )
-        status = r.status_code
-        # print(r.url)
-        # print(status)
-        # print(r.headers)
-        # print(r.text)
+            await self.load_cookies()
+        self._refresh_if_expiring()
+        cookies = self.cookies
+        proxy = self.proxies.pick() if self.proxies else None
+        if proxy is None and self.proxies and not config.PROXY.fallback_direct:
+            raise RuntimeError('Нет доступных прокси')
+        started = await self.limiter.acquire()
+        try:
+            status, res, renewed, retry_after = await self._send(proxy, params, cookies)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            # Таймауты и обрывы - такой же признак перегрузки, как 429/5xx
+            self.limiter.release(started, overloaded=True)
+            metrics.API_REQUESTS.labels(self.username, 'error').inc()
+            raise
+        except BaseException:
+            self.limiter.release(started)
+            raise
+        self._latency.observe(time.monotonic() - started)
+        metrics.API_REQUESTS.labels(self.username, str(status)).inc()
+        # 403 - отказ адресу (бан прокси), 408 - таймаут на стороне API: то же, что перегрузка
+        overloaded = status in UPSTREAM_STATUSES or status >= 500
+        self.limiter.release(started, overloaded, retry_after)
+        if overloaded:
+            LOGGER.warning(f"{pass_no}: API ответило {status}, аккаунт {self.username}, "
+                           f"лимит {self.limiter.limit}")
+            raise UpstreamError(status, retry_after)
+        if renewed is not None and renewed.value and status != 401:
+            await self._renew_cookie(renewed)
+        if status != 401 and cookies is self._fresh_cookies:
+            self._fresh_cookies = None
         if status == 200:
             self.total_passed += 1
-            self.fails = 0
-            res = r.json()
-            LOGGER.info(f"{self.total_passed} --- {pass_no}: {res['vin']} :: {res['regNum']} :: {res['statusCode']}")
-            return res
+            LOOKUP_LOGGER.info('%s --- %s: %s :: %s :: %s', self.total_passed, pass_no,
+                               res['vin'], res['regNum'], res['statusCode'])
+            # Из ответа остаются только колонки passes.passes
+            return PassRecord.from_response(res)
         elif status in [404, 400]:
             self.total_passed += 1
-            self.fails = 0
-            LOGGER.info(f'{self.total_passed} --- {pass_no} Не существует')
+            LOOKUP_LOGGER.info('%s --- %s Не существует', self.total_passed, pass_no)
             return None
         elif status == 401:
-            self.fails += 1
-            print("Unauthorized")
-            # sys.exit(1)
-            await self.auth()
-            if self.fails <= 10:
-                return await self.get_pass_info(pass_no)
-            else:
-                LOGGER.critical(
-                    f"Too much fails for {pass_no}, account {self.username}, total passed: {self.total_passed}")
-                sys.exit(1)
+            LOGGER.debug(f"{pass_no}: 401 для аккаунта {self.username}")
+            # 401 на куки прямо из авторизации - признак того, что авторизация не помогает
+            fresh = cookies is self._fresh_cookies
+            started = False
+            # Если куки уже обновил другой запрос, пока этот был в пути, авторизация не нужна
+            if self.cookies is cookies:
+                started = await self.auth()
+            # Неудачная авторизация оставляет в passes.accounts те же куки
+            renewed = self.cookies is not None and self.cookies != cookies
+            # Истечение куки, после которого сессия обновилась, - не сбой аккаунта. Неудачная
+            # авторизация и 401 на свежие куки - сбой, но один на событие, а не на каждый
+            # запрос в пути: его засчитывает тот, кто запустил авторизацию
+            failure = started and (fresh or not renewed)
+            raise Unauthorized(f"{pass_no}: 401 для аккаунта {self.username}", failure=failure)
+        # "Не существует" - только 404/400; всё остальное (3xx, прочие 4xx) - не ответ о номере
+        LOGGER.warning(f"{pass_no}: неожиданный ответ API {status}, аккаунт {self.username}")
+        raise UnexpectedStatus(status)
 
 
-if __name__ == "__main__":
+async def _main():
     pmos = MosPass('nixncom@gmail.com', 'qAzWsX159$$$2')
     start_n = 1677805
     stop_n = 1800000
     step = 1
-    for i in range(start_n, stop_n, step):
-        s = str(i)
-        while len(s) < 7:
-            s = '0' + s
-        stat = asyncio.run(pmos.get_pass_info(f"БА {s}"))
-        if stat:
-            if isinstance(stat, dict):
-                LOGGER.info(
-                    f"{pmos.total_passed} --- БА {s}: {stat['vin']} :: {stat['regNum']} :: {stat['statusCode']}")
-                asyncio.run(db.set_pass(stat))
-        else:
-            LOGGER.info(f'{pmos.total_passed} --- БА {s} Не существует')
+    try:
+        await db.ensure_schema()
+        for i in range(start_n, stop_n, step):
+            s = str(i)
+            while len(s) < 7:
+                s = '0' + s
+            stat = await pmos.get_pass_info(f"БА {s}")
+            if stat:
+                if isinstance(stat, PassRecord):
+                    LOGGER.info(
+                        f"{pmos.total_passed} --- БА {s}: {stat.vin} :: {stat.reg_number} :: "
+                        f"{'Active' if stat.status else 'Cancelled'}")
+                    await db.set_pass(stat)
+            else:
+                LOGGER.info(f'{pmos.total_passed} --- БА {s} Не существует')
+    finally:
+        await pmos.close()
+        await db.close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
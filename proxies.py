@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import random
+import time
+
+import aiohttp
+
+import config
+import db
+from passes import HEADERS
+
+LOGGER = logging.getLogger(__name__)
+
+# Ответы, которыми API отказывает конкретному адресу
+BAN_STATUSES = (403, 429)
+
+
+def _proxy_url(entry) -> str | None:
+    # ipArch отдаёт либо строки вида scheme://[user:pass@]host:port, либо словари
+    if isinstance(entry, str):
+        return entry if '://' in entry else f'http://{entry}'
+    if isinstance(entry, dict):
+        for key in ('proxy', 'url'):
+            if entry.get(key):
+                return _proxy_url(entry[key])
+        host = entry.get('host') or entry.get('ip')
+        if host and entry.get('port'):
+            user = entry.get('login') or entry.get('user') or entry.get('username')
+            auth = f"{user}:{entry.get('password', '')}@" if user else ''
+            return f"{entry.get('scheme', 'http')}://{auth}{host}:{entry['port']}"
+    return None
+
+
+class Proxy:
+    """Один выходной адрес: свой пул соединений, свой лимит одновременных запросов и оценка здоровья."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.session = None
+        self.semaphore = None
+        self._session_loop = None
+        self.in_flight = 0
+        self.evicted_until = 0.0
+        self.evictions = 0
+        self._reset_stats()
+
+    def _reset_stats(self):
+        # Экспоненциально сглаженные задержка (сек), доля ошибок и доля банов
+        self.latency = None
+        self.error_rate = 0.0
+        self.ban_rate = 0.0
+        self.samples = 0
+
+    def get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self.session is None or self.session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=config.PROXY.pool_size,
+                keepalive_timeout=config.API.keepalive_timeout,
+                ssl=False
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                headers=HEADERS,
+                timeout=aiohttp.ClientTimeout(total=config.API.timeout),
+                cookie_jar=aiohttp.DummyCookieJar()
+            )
+            self.semaphore = asyncio.Semaphore(config.PROXY.concurrency)
+            self._session_loop = loop
+        return self.session
+
+    @property
+    def health(self) -> float:
+        """От 0 (непригоден) до 1 (здоров)."""
+        latency_factor = 1.0
+        if self.latency:
+            latency_factor = min(1.0, config.PROXY.target_latency / self.latency)
+        return (1 - self.error_rate) * (1 - self.ban_rate) * latency_factor
+
+    @property
+    def admitted(self) -> bool:
+        return time.monotonic() >= self.evicted_until
+
+    def record(self, status: int | None, latency: float):
+        """status=None - запрос не дошёл (ошибка соединения, таймаут)."""
+        alpha = config.PROXY.ewma_alpha
+        error = status is None or status >= 500
+        ban = status in BAN_STATUSES
+        self.error_rate += alpha * (error - self.error_rate)
+        self.ban_rate += alpha * (ban - self.ban_rate)
+        if not error:
+            self.latency = latency if self.latency is None else self.latency + alpha * (latency - self.latency)
+        self.samples += 1
+        if self.samples >= config.PROXY.min_samples and self.health < config.PROXY.min_health:
+            self.evict()
+
+    def evict(self):
+        self.evictions += 1
+        # Каждое следующее исключение подряд - вдвое дольше, но не больше max_cooldown
+        cooldown = min(config.PROXY.cooldown * 2 ** (self.evictions - 1), config.PROXY.max_cooldown)
+        self.evicted_until = time.monotonic() + cooldown
+        LOGGER.warning(f"Прокси {self.url} выведен из ротации на {cooldown:.0f} сек "
+                       f"(ошибки {self.error_rate:.2f}, баны {self.ban_rate:.2f}, задержка {self.latency})")
+        # После возвращения прокси начинает с чистой статистики
+        self._reset_stats()
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+
+class ProxyPool:
+    """Прокси из db.get_proxies(), запросы раздаются самым здоровым и наименее загруженным."""
+
+    def __init__(self):
+        self.proxies = {}
+
+    def __len__(self):
+        return len(self.proxies)
+
+    async def load(self):
+        entries = await asyncio.to_thread(db.get_proxies, config.PROXY.source_url)
+        if isinstance(entries, dict):
+            entries = entries.get('proxies', list(entries.values()))
+        for entry in entries:
+            url = _proxy_url(entry)
+            if url and url not in self.proxies:
+                self.proxies[url] = Proxy(url)
+        LOGGER.info(f"Загружено прокси: {len(self.proxies)}")
+        return self
+
+    def pick(self) -> Proxy | None:
+        admitted = [proxy for proxy in self.proxies.values() if proxy.admitted]
+        if not admitted:
+            return None
+        # Перемешиваем, чтобы при равной оценке нагрузка расходилась по всем адресам
+        random.shuffle(admitted)
+        proxy = max(admitted, key=lambda p: p.health / (1 + p.in_flight / config.PROXY.concurrency))
+        if proxy.evictions and proxy.samples >= config.PROXY.min_samples:
+            # Прокси снова прошёл испытательный срок
+            proxy.evictions = 0
+        return proxy
+
+    async def close(self):
+        for proxy in self.proxies.values():
+            await proxy.close()
@@ -1,14 +1,17 @@
 import asyncio
+import collections
+import datetime
 import logging
-import random
 import time
-import traceback
+from typing import NamedTuple
 
-from db import get_last_pass
-import pika
-from pika.exceptions import AMQPConnectionError
+import aio_pika
 
-from passes import MosPass
+from db import get_last_pass, close_pool
+
+import negindex
+from accounts import AccountPool
+from workitems import format_pass, split_range
 
 LOGGER = logging.getLogger(__name__)
 rabbit_config = {
@@ -19,85 +22,223 @@ rabbit_config = {
     'vhost': 'mos_passes',
     'queue': 'urgent_q'
 }
-pmos = MosPass('nixncom@gmail.com', 'qAzWsX159$$$3')
+ACCOUNTS = AccountPool()
+
+
+# Сколько сообщений может ждать подтверждения брокера одновременно
+PUBLISH_WINDOW = 256
+# Как часто печатать скорость отправки, сообщений
+REPORT_EVERY = 1000
+
+
+class PublishReport(NamedTuple):
+    sent: int  # сколько элементов ушло в канал (остальные не отправлялись вовсе)
+    confirmed: int  # сколько из них брокер подтвердил
+    unconfirmed: list  # элементы, ушедшие в канал, но не подтверждённые брокером
+    elapsed: float
+
+    @property
+    def rate(self) -> float:
+        return self.confirmed / self.elapsed if self.elapsed else 0.0
+
+
+async def _iterate(items):
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
 
+async def send_passes_to_rabbitmq(items, rate: float | None = None) -> PublishReport:
+    """
+    Потоковая отправка элементов очереди из любого итератора (обычного или асинхронного)
+    по одному каналу с подтверждениями публикации. Одновременно ждут подтверждения
+    не больше PUBLISH_WINDOW сообщений, поэтому память не зависит от размера диапазона.
+    rate - не больше стольких сообщений в секунду.
+    При ошибке отправка останавливается, а в отчёте видно, что именно дошло до брокера.
+    """
+    sent = 0
+    confirmed = 0
+    unconfirmed = []
+    pending = collections.deque()
+    started = time.perf_counter()
+
+    async def settle(item, confirmation):
+        nonlocal confirmed
+        try:
+            await confirmation
+        except Exception as e:
+            LOGGER.error(f"Брокер не подтвердил {item}: {e}")
+            unconfirmed.append(item)
+            return False
+        confirmed += 1
+        if confirmed % REPORT_EVERY == 0:
+            print(f"Подтверждено: {confirmed}, {confirmed / (time.perf_counter() - started):.0f} сообщ./сек")
+        return True
 
-def send_passes_to_rabbitmq(passes):
     try:
-        # Установка соединения с RabbitMQ
-        credentials = pika.PlainCredentials(rabbit_config['user'], rabbit_config['password'])
-        parameters = pika.ConnectionParameters(
+        connection = await aio_pika.connect(
             host=rabbit_config['host'],
             port=rabbit_config['port'],
-            virtual_host=rabbit_config['vhost'],
-            credentials=credentials
+            login=rabbit_config['user'],
+            password=rabbit_config['password'],
+            virtualhost=rabbit_config['vhost']
         )
-
-        connection = pika.BlockingConnection(parameters)
-        channel = connection.channel()
-
-        # Убедимся, что очередь существует
-        channel.queue_declare(queue=rabbit_config['queue'], durable=True)
-
-        # Отправка VIN'ов в очередь
-        i = 0
-        total_elapsed = len(passes)
-        for p in passes:
-            channel.basic_publish(
-                exchange='',
-                routing_key=rabbit_config['queue'],
-                body=p,
-                properties=pika.BasicProperties(
-                    delivery_mode=2,  # Make message persistent
-                ))
-            i += 1
-            total_elapsed -= 1
-            if i >= 1000:
-                print(f"Отправлено пропусков: {i} из {len(passes)}, осталось {total_elapsed}")
-                i = 0
-
-        connection.close()
+        async with connection:
+            channel = await connection.channel(publisher_confirms=True)
+            # Убедимся, что очередь существует
+            await channel.declare_queue(rabbit_config['queue'], durable=True)
+            try:
+                async for item in _iterate(items):
+                    if rate:
+                        delay = started + sent / rate - time.perf_counter()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                    if len(pending) >= PUBLISH_WINDOW:
+                        if not await settle(*pending.popleft()):
+                            LOGGER.error(f"Отправка остановлена, не отправлено начиная с {item}")
+                            break
+                    confirmation = asyncio.ensure_future(channel.default_exchange.publish(
+                        aio_pika.Message(
+                            body=item.encode('utf-8'),
+                            delivery_mode=aio_pika.DeliveryMode.PERSISTENT,  # Make message persistent
+                            # По нему потребитель считает задержку очереди
+                            timestamp=datetime.datetime.now(datetime.timezone.utc)
+                        ),
+                        routing_key=rabbit_config['queue']
+                    ))
+                    pending.append((item, confirmation))
+                    sent += 1
+            finally:
+                while pending:
+                    await settle(*pending.popleft())
     except Exception as e:
         print(f"Ошибка при работе с RabbitMQ: {e}")
 
+    report = PublishReport(sent, confirmed, unconfirmed, time.perf_counter() - started)
+    LOGGER.info(f"Отправлено: {report.sent}, подтверждено: {report.confirmed}, "
+                f"{report.rate:.0f} сообщ./сек")
+    if report.unconfirmed:
+        LOGGER.error(f"Не подтверждены брокером: {report.unconfirmed}")
+    return report
+
+
+SERIES = 'БА'
+# Сколько соседних номеров проверяется вокруг каждого кандидата,
+# чтобы одиночные дыры в нумерации не принимались за границу
+PROBE_WINDOW = 3
+# Сколько номеров за найденной границей должно подряд не существовать, чтобы ей поверить:
+# дыры встречаются и длиннее PROBE_WINDOW, а ошибка в середине поиска уводит границу далеко назад
+CONFIRM_WINDOW = 100
+# Сколько номеров помещается в один элемент очереди ("БА 1677805..1678804")
+RANGE_SIZE = 1000
+
+
+async def find_frontier(start_pass: int):
+    """
+    Ищет последний выданный номер после start_pass: экспоненциальный шаг вперёд,
+    пока пропуска находятся, затем двоичный поиск границы. Найденная граница
+    проверяется окном в CONFIRM_WINDOW номеров за ней; если там есть пропуск,
+    поиск продолжается от него.
+    Возвращает (последний выданный номер, число запросов к API).
+    """
+    probes = 0
+
+    async def probe(number, width=PROBE_WINDOW):
+        # Наибольший найденный номер в окне [number, number + width) или None
+        nonlocal probes
+        window = range(number, number + width)
+        probes += len(window)
+        # Мимо кэша: граница выдачи сдвигается, а probes считает именно запросы к API
+        results = await asyncio.gather(*[ACCOUNTS.get_pass_info(format_pass(n, SERIES), refresh=True)
+                                         for n in window],
+                                       return_exceptions=True)
+        errors = [res for res in results if isinstance(res, BaseException)]
+        if len(errors) == len(results):
+            # Ни одного ответа по окну: граница неизвестна, продолжать поиск нельзя
+            raise errors[0]
+        found = None
+        for n, res in zip(window, results):
+            if isinstance(res, BaseException):
+                LOGGER.error(f'Ошибка проверки {format_pass(n, SERIES)}: {res}')
+            elif res:
+                found = n
+        return found
+
+    async def search(low):
+        step = 1
+        while True:
+            candidate = low + step
+            print(f'Try {format_pass(candidate, SERIES)}')
+            found = await probe(candidate)
+            if found is None:
+                high = candidate
+                break
+            low = found
+            step *= 2
+
+        # low - выданный номер, в окне от high пропусков нет
+        while high - low > 1:
+            mid = (low + high) // 2
+            print(f'Try {format_pass(mid, SERIES)}')
+            found = await probe(mid)
+            if found is None:
+                high = mid
+            else:
+                low = found
+        return low, high
+
+    async def confirm(high):
+        # Окна за уже проверенным [high, high + PROBE_WINDOW) растут вдвое,
+        # чтобы настоящая граница обходилась в несколько запросов, а не в CONFIRM_WINDOW по одному
+        number, width = high + PROBE_WINDOW, PROBE_WINDOW * 2
+        while number < high + CONFIRM_WINDOW:
+            width = min(width, high + CONFIRM_WINDOW - number)
+            found = await probe(number, width)
+            if found is not None:
+                return found
+            number += width
+            width *= 2
+        return None
+
+    low = start_pass
+    while True:
+        low, high = await search(low)
+        found = await confirm(high)
+        if found is None:
+            return low, probes
+        LOGGER.info(f'За {format_pass(low, SERIES)} найден {format_pass(found, SERIES)}: граница дальше')
+        low = found
+
 
 async def find_range():
     start_pass = await get_last_pass()
     print(start_pass)
     if not start_pass:
         return None
-    current_pass = start_pass
 
-    flag = True
-    while flag:
-        current_pass += random.randint(450, 550)
-        try:
-            s = str(current_pass)
-            while len(s) < 7:
-                s = '0' + s
-            s = f'БА {s}'
-            print(f'Try {s}')
-            res = await pmos.get_pass_info(s)
-            if res is None:
-                flag = False
-        except Exception as e:
-            traceback.print_exc()
-    stop_pass = current_pass
-    passes = []
-    for i in range(start_pass, stop_pass):
-        s = str(i)
-        while len(s) < 7:
-            s = '0' + s
-        s = f'БА {s}'
-        passes.append(s)
-    if len(passes) == 0:
-        return None
-    return passes
+    stop_pass, probes = await find_frontier(start_pass)
+    LOGGER.info(f'Последний выданный номер {format_pass(stop_pass, SERIES)}, запросов к API: {probes}')
+    # Генератор: элементы очереди создаются по мере отправки;
+    # куски, где все номера недавно подтверждённо отсутствовали, не отправляются
+    return negindex.skip_missing(split_range(SERIES, start_pass, stop_pass, RANGE_SIZE))
+
+
+async def main():
+    try:
+        await ACCOUNTS.load()
+        passes = await find_range()
+        if passes:
+            await send_passes_to_rabbitmq(passes)
+        else:
+            print("Ошибка при генерации пропусков")
+    finally:
+        await ACCOUNTS.close()
+        await close_pool()
+        negindex.close()
 
 
 if __name__ == '__main__':
-    passes = asyncio.run(find_range())
-    if passes:
-        send_passes_to_rabbitmq(passes)
-    else:
-        print("Ошибка при генерации пропусков")
+    asyncio.run(main())
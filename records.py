@@ -0,0 +1,58 @@
+"""
+Пропуск в том виде, в каком он хранится в passes.passes.
+
+Ответ API (/api/Pass/GetPassBySeriesAndNumber) - словарь со всеми полями, которые отдаёт
+сервис; PassRecord оставляет только колонки таблицы, уже разобранными, и весит как
+кортеж из восьми ссылок. Поля идут в порядке колонок и первых параметров
+sql/insert_pass.sql, поэтому запись передаётся в executemany и COPY как есть.
+"""
+import datetime
+import sys
+from typing import NamedTuple
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def parse_timestamp(value: str) -> datetime.datetime:
+    """'2024-01-01T00:00:00Z' -> datetime без часового пояса, как strptime(TIMESTAMP_FORMAT)."""
+    # fromisoformat написан на C и в разы быстрее strptime; формат API фиксированный,
+    # всё остальное разбирается по-старому
+    if len(value) == 20 and value[19] == 'Z' and value[10] == 'T':
+        return datetime.datetime.fromisoformat(value[:19])
+    return datetime.datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+class PassRecord(NamedTuple):
+    series: str
+    number: str
+    time_of_day: str
+    status: bool
+    vin: str
+    reg_number: str
+    start_date: datetime.datetime
+    finish_date: datetime.datetime
+
+    @property
+    def key(self) -> tuple:
+        return self[0], self[1]
+
+    @classmethod
+    def from_response(cls, response: dict) -> 'PassRecord':
+        parts = str(response['seriesAndNumber']).split(' ')
+        return cls(
+            # Серий и вариантов времени суток единицы, а записей - сотни тысяч:
+            # одна строка на значение
+            sys.intern(parts[0].strip()),
+            parts[1].strip(),
+            sys.intern(response['passTimeOfDay']),
+            response['statusCode'] == 'Active',
+            response['vin'],
+            response['regNum'],
+            parse_timestamp(response['startDate']),
+            parse_timestamp(response['finishDate'])
+        )
+
+
+def as_record(value) -> PassRecord:
+    """PassRecord как есть, словарь ответа API - разбирается."""
+    return value if isinstance(value, PassRecord) else PassRecord.from_response(value)
@@ -0,0 +1,68 @@
+"""
+Планировщик перепроверки уже известных пропусков.
+
+Вместо пересканирования диапазонов номеров в очередь ставятся только пропуски,
+которые вероятно изменились: истёкшие или начавшиеся после последней проверки
+и давно не проверявшиеся действующие (приоритеты в sql/select_refresh.sql).
+Кандидаты читаются одним запросом (не больше REFRESH.limit) и уже после этого
+отправляются в очередь с ограниченной скоростью.
+"""
+import argparse
+import asyncio
+import collections
+import contextlib
+import logging
+
+import db
+from config import REFRESH
+from push_to_q import send_passes_to_rabbitmq
+from workitems import format_pass
+
+LOGGER = logging.getLogger(__name__)
+
+
+async def due_passes(limit, counts):
+    """Элементы очереди для кандидатов на перепроверку; counts считает их по приоритетам."""
+    candidates = await db.get_refresh_candidates(
+        limit=limit,
+        max_priority=REFRESH.max_priority,
+        stale_after=REFRESH.stale_after,
+        min_age=REFRESH.min_age
+    )
+    for record in candidates:
+        counts[record['priority']] += 1
+        yield format_pass(int(record['number']), record['series'])
+
+
+async def refresh_once(limit=None, rate=None):
+    counts = collections.Counter()
+    async with contextlib.aclosing(due_passes(limit or REFRESH.limit, counts)) as items:
+        report = await send_passes_to_rabbitmq(items, rate=rate or REFRESH.rate)
+    LOGGER.info(f"Перепроверка: в очереди {report.confirmed} из {report.sent}, "
+                f"по приоритетам {dict(sorted(counts.items()))}")
+    return report
+
+
+async def run(once=False, limit=None, rate=None):
+    try:
+        await db.ensure_schema()
+        while True:
+            report = await refresh_once(limit, rate)
+            if once:
+                return report
+            await asyncio.sleep(REFRESH.interval)
+    finally:
+        await db.close_pool()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Постановка пропусков на перепроверку')
+    parser.add_argument('--once', action='store_true', help='один проход и выход')
+    parser.add_argument('--limit', type=int, default=REFRESH.limit, help='пропусков за проход')
+    parser.add_argument('--rate', type=float, default=REFRESH.rate, help='сообщ./сек')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    asyncio.run(run(args.once, args.limit, args.rate))
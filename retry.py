@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import random
+import time
+
+import aiohttp
+
+import config
+
+LOGGER = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Цепь разомкнута: запросы через неё сейчас не выполняются, работу надо отдать другому или вернуть в очередь."""
+
+    def __init__(self, name, retry_in):
+        super().__init__(f'Цепь {name} разомкнута, повтор через {retry_in:.0f} сек')
+        self.name = name
+        self.retry_in = retry_in
+
+
+class UpstreamError(Exception):
+    """
+    API перегружено, недоступно или отказывает адресу (403, 408, 429, 5xx):
+    результат неизвестен, запрос надо повторить позже.
+    """
+
+    def __init__(self, status, retry_after=None, message=''):
+        super().__init__(message or f'API ответило {status}')
+        self.status = status
+        self.retry_after = retry_after
+
+
+class UnexpectedStatus(Exception):
+    """API ответило статусом, который не означает ни "найден", ни "не существует"."""
+
+    def __init__(self, status, message=''):
+        super().__init__(message or f'Неожиданный ответ API: {status}')
+        self.status = status
+
+
+class Unauthorized(Exception):
+    """
+    API ответило 401 (переавторизация уже запущена или выполнена).
+    failure=False - куки просто устарели и сессия обновлена (или это же событие уже
+    засчитано другому запросу): повтор нужен, но цепи сбоем это не считают.
+    """
+
+    def __init__(self, message='', failure=True):
+        super().__init__(message)
+        self.failure = failure
+
+
+class RetryPolicy:
+    """Экспоненциальная задержка с полным джиттером: случайная пауза от 0 до base * 2**attempt, не больше cap."""
+
+    def __init__(self, attempts: int | None, base: float, cap: float, trips: tuple = ()):
+        self.attempts = attempts  # None - без ограничения
+        self.base = base
+        self.cap = cap
+        # Какие цепи (account, endpoint) считают эту ошибку сбоем
+        self.trips = trips
+
+    def delay(self, attempt: int, error: Exception | None = None) -> float:
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after:
+            delay = max(delay, retry_after)
+        return delay
+
+    def exhausted(self, attempt: int) -> bool:
+        return self.attempts is not None and attempt + 1 >= self.attempts
+
+
+class CircuitBreaker:
+    """
+    После failure_threshold сбоев подряд цепь размыкается на reset_timeout сек,
+    затем пропускает один пробный запрос: успех замыкает её, сбой снова размыкает.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_started = None
+
+    def retry_in(self) -> float:
+        if self.state == 'half_open' and self._trial_started is not None:
+            # Пока идёт пробный запрос - до конца отведённого ему окна
+            return max(0.0, self._trial_started + self.reset_timeout - time.monotonic())
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    @property
+    def is_open(self) -> bool:
+        """Разомкнута и ещё не готова к пробному запросу."""
+        if self.state == 'closed':
+            return False
+        if self.state == 'open':
+            return self.retry_in() > 0
+        # half_open: пока идёт пробный запрос, остальные не пропускаются
+        return self._trial_started is not None and time.monotonic() - self._trial_started < self.reset_timeout
+
+    def allow(self):
+        if self.is_open:
+            raise CircuitOpenError(self.name, self.retry_in())
+        if self.state != 'closed':
+            self.state = 'half_open'
+            self._trial_started = time.monotonic()
+
+    def record_success(self):
+        if self.state != 'closed':
+            LOGGER.info(f"Цепь {self.name} замкнута")
+        self.state = 'closed'
+        self.failures = 0
+        self._trial_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.failure_threshold:
+            if self.state != 'open':
+                LOGGER.warning(f"Цепь {self.name} разомкнута на {self.reset_timeout} сек после {self.failures} сбоев")
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+            self._trial_started = None
+
+
+_BREAKERS = {}
+
+
+def breaker(name: str) -> CircuitBreaker:
+    """Общая на процесс цепь по имени: 'account:<логин>', 'endpoint:<url>'."""
+    if name not in _BREAKERS:
+        _BREAKERS[name] = CircuitBreaker(name, config.RETRY.failure_threshold, config.RETRY.reset_timeout)
+    return _BREAKERS[name]
+
+
+def policy_for(error: Exception) -> RetryPolicy | None:
+    """Политика повторов для класса ошибки; None - ошибка не повторяется."""
+    if isinstance(error, Unauthorized):
+        return RetryPolicy(config.RETRY.auth_attempts, *config.RETRY.auth_delay, trips=('account',))
+    if isinstance(error, UpstreamError):
+        return RetryPolicy(config.RETRY.upstream_attempts, *config.RETRY.upstream_delay, trips=('account', 'endpoint'))
+    if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError)):
+        return RetryPolicy(config.RETRY.network_attempts, *config.RETRY.network_delay, trips=('endpoint',))
+    return None
+
+
+async def call(fn, *args, breakers: dict | None = None):
+    """
+    Вызывает fn(*args) с повторами по policy_for. breakers - цепи по областям
+    ({'account': ..., 'endpoint': ...}); пока любая разомкнута, вызов сразу
+    завершается CircuitOpenError.
+    """
+    breakers = breakers or {}
+    attempt = 0
+    while True:
+        for circuit in breakers.values():
+            circuit.allow()
+        try:
+            result = await fn(*args)
+        except Exception as e:
+            policy = policy_for(e)
+            if policy is None:
+                raise
+            # Например, 401 по устаревшим куки, после которого сессия обновилась
+            if getattr(e, 'failure', True):
+                for scope in policy.trips:
+                    if scope in breakers:
+                        breakers[scope].record_failure()
+            if policy.exhausted(attempt):
+                raise
+            delay = policy.delay(attempt, e)
+            LOGGER.info(f"Повтор через {delay:.1f} сек после ошибки: {e!r}")
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        for circuit in breakers.values():
+            circuit.record_success()
+        return result
@@ -0,0 +1,12 @@
+CREATE TEMP TABLE passes_staging ON COMMIT DROP AS
+    SELECT
+        series,
+        "number",
+        time_of_day,
+        status,
+        vin,
+        reg_number,
+        start_date,
+        finish_date
+    FROM passes.passes
+    WITH NO DATA
\ No newline at end of file
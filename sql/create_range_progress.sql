@@ -0,0 +1,5 @@
+CREATE TABLE IF NOT EXISTS passes.range_progress(
+    item text PRIMARY KEY,
+    done_upto bigint NOT NULL,
+    updated_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
\ No newline at end of file
@@ -8,7 +8,8 @@ INSERT INTO
         reg_number,
         start_date,
         finish_date,
-        updated_at
+        updated_at,
+        last_checked
     )
     VALUES (
         {{SERIES}},
@@ -19,13 +20,53 @@ INSERT INTO
         {{REG}},
         {{START}},
         {{FINISH}},
+        CURRENT_TIMESTAMP,
         CURRENT_TIMESTAMP
     )
 ON CONFLICT (series, "number") DO UPDATE SET
-    time_of_day = {{TD}},
-    status = {{STATUS}},
-    vin = {{VIN}},
-    reg_number = {{REG}},
-    start_date = {{START}},
-    finish_date = {{FINISH}},
-    updated_at = CURRENT_TIMESTAMP
\ No newline at end of file
+    time_of_day = EXCLUDED.time_of_day,
+    status = EXCLUDED.status,
+    vin = EXCLUDED.vin,
+    reg_number = EXCLUDED.reg_number,
+    start_date = EXCLUDED.start_date,
+    finish_date = EXCLUDED.finish_date,
+    updated_at = CASE
+        WHEN (
+            passes.passes.time_of_day,
+            passes.passes.status,
+            passes.passes.vin,
+            passes.passes.reg_number,
+            passes.passes.start_date,
+            passes.passes.finish_date
+        ) IS DISTINCT FROM (
+            EXCLUDED.time_of_day,
+            EXCLUDED.status,
+            EXCLUDED.vin,
+            EXCLUDED.reg_number,
+            EXCLUDED.start_date,
+            EXCLUDED.finish_date
+        ) THEN CURRENT_TIMESTAMP
+        ELSE passes.passes.updated_at
+    END,
+    last_checked = CURRENT_TIMESTAMP
+    WHERE (
+        passes.passes.time_of_day,
+        passes.passes.status,
+        passes.passes.vin,
+        passes.passes.reg_number,
+        passes.passes.start_date,
+        passes.passes.finish_date
+    ) IS DISTINCT FROM (
+        EXCLUDED.time_of_day,
+        EXCLUDED.status,
+        EXCLUDED.vin,
+        EXCLUDED.reg_number,
+        EXCLUDED.start_date,
+        EXCLUDED.finish_date
+    )
+    -- Строка без изменений получает только отметку last_checked, и лишь когда прошлая
+    -- устарела - по тем же условиям, что в sql/touch_passes.sql
+    OR passes.passes.last_checked IS NULL
+    OR passes.passes.last_checked < CURRENT_TIMESTAMP - {{GRANULARITY}}::interval
+    OR (passes.passes.start_date <= CURRENT_TIMESTAMP AND passes.passes.last_checked < passes.passes.start_date)
+    OR (passes.passes.finish_date <= CURRENT_TIMESTAMP AND passes.passes.last_checked < passes.passes.finish_date)
\ No newline at end of file
@@ -0,0 +1,72 @@
+INSERT INTO
+    passes.passes(
+        series,
+        "number",
+        time_of_day,
+        status,
+        vin,
+        reg_number,
+        start_date,
+        finish_date,
+        updated_at,
+        last_checked
+    )
+    SELECT
+        series,
+        "number",
+        time_of_day,
+        status,
+        vin,
+        reg_number,
+        start_date,
+        finish_date,
+        CURRENT_TIMESTAMP,
+        CURRENT_TIMESTAMP
+    FROM passes_staging
+ON CONFLICT (series, "number") DO UPDATE SET
+    time_of_day = EXCLUDED.time_of_day,
+    status = EXCLUDED.status,
+    vin = EXCLUDED.vin,
+    reg_number = EXCLUDED.reg_number,
+    start_date = EXCLUDED.start_date,
+    finish_date = EXCLUDED.finish_date,
+    updated_at = CASE
+        WHEN (
+            passes.passes.time_of_day,
+            passes.passes.status,
+            passes.passes.vin,
+            passes.passes.reg_number,
+            passes.passes.start_date,
+            passes.passes.finish_date
+        ) IS DISTINCT FROM (
+            EXCLUDED.time_of_day,
+            EXCLUDED.status,
+            EXCLUDED.vin,
+            EXCLUDED.reg_number,
+            EXCLUDED.start_date,
+            EXCLUDED.finish_date
+        ) THEN CURRENT_TIMESTAMP
+        ELSE passes.passes.updated_at
+    END,
+    last_checked = CURRENT_TIMESTAMP
+    WHERE (
+        passes.passes.time_of_day,
+        passes.passes.status,
+        passes.passes.vin,
+        passes.passes.reg_number,
+        passes.passes.start_date,
+        passes.passes.finish_date
+    ) IS DISTINCT FROM (
+        EXCLUDED.time_of_day,
+        EXCLUDED.status,
+        EXCLUDED.vin,
+        EXCLUDED.reg_number,
+        EXCLUDED.start_date,
+        EXCLUDED.finish_date
+    )
+    -- Строка без изменений получает только отметку last_checked, и лишь когда прошлая
+    -- устарела - по тем же условиям, что в sql/touch_passes.sql
+    OR passes.passes.last_checked IS NULL
+    OR passes.passes.last_checked < CURRENT_TIMESTAMP - {{GRANULARITY}}::interval
+    OR (passes.passes.start_date <= CURRENT_TIMESTAMP AND passes.passes.last_checked < passes.passes.start_date)
+    OR (passes.passes.finish_date <= CURRENT_TIMESTAMP AND passes.passes.last_checked < passes.passes.finish_date)
\ No newline at end of file
@@ -0,0 +1,2 @@
+ALTER TABLE passes.passes
+    ADD COLUMN IF NOT EXISTS last_checked timestamp
\ No newline at end of file
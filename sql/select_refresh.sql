@@ -0,0 +1,26 @@
+SELECT
+    series,
+    "number",
+    priority
+FROM (
+    SELECT
+        series,
+        "number",
+        COALESCE(last_checked, updated_at) AS checked_at,
+        CASE
+            -- Срок действия истёк после последней проверки: статус почти наверняка сменился
+            WHEN status AND finish_date <= CURRENT_TIMESTAMP
+                AND COALESCE(last_checked, updated_at) < finish_date THEN 0
+            -- Срок действия начался после последней проверки: пропуск мог стать действующим
+            WHEN NOT status AND start_date <= CURRENT_TIMESTAMP AND finish_date > CURRENT_TIMESTAMP
+                AND COALESCE(last_checked, updated_at) < start_date THEN 1
+            -- Действующий пропуск давно не проверялся: его могли аннулировать
+            WHEN status AND COALESCE(last_checked, updated_at) < CURRENT_TIMESTAMP - {{STALE_AFTER}}::interval THEN 2
+            ELSE 3
+        END AS priority
+    FROM passes.passes
+    WHERE COALESCE(last_checked, updated_at) < CURRENT_TIMESTAMP - {{MIN_AGE}}::interval
+) due
+WHERE priority <= {{MAX_PRIORITY}}
+ORDER BY priority, checked_at
+LIMIT {{LIMIT}}
\ No newline at end of file
@@ -0,0 +1,14 @@
+UPDATE passes.passes p SET
+    last_checked = CURRENT_TIMESTAMP
+    FROM unnest({{SERIES}}::text[], {{NUMBER}}::text[]) AS checked(series, "number")
+WHERE p.series = checked.series
+    AND p."number" = checked."number"
+    -- Отметка с точностью до DB.checked_granularity: перепроверка без изменений не пишет новую
+    -- версию строки, пока прошлая отметка не устарела. Исключение - начало и конец срока
+    -- после прошлой отметки: по ним sql/select_refresh.sql выбирает пропуск снова
+    AND (
+        p.last_checked IS NULL
+        OR p.last_checked < CURRENT_TIMESTAMP - {{GRANULARITY}}::interval
+        OR (p.start_date <= CURRENT_TIMESTAMP AND p.last_checked < p.start_date)
+        OR (p.finish_date <= CURRENT_TIMESTAMP AND p.last_checked < p.finish_date)
+    )
\ No newline at end of file
@@ -0,0 +1,14 @@
+INSERT INTO
+    passes.range_progress(
+        item,
+        done_upto,
+        updated_at
+    )
+    VALUES (
+        {{ITEM}},
+        {{DONE_UPTO}},
+        CURRENT_TIMESTAMP
+    )
+ON CONFLICT (item) DO UPDATE SET
+    done_upto = GREATEST(passes.range_progress.done_upto, {{DONE_UPTO}}),
+    updated_at = CURRENT_TIMESTAMP
\ No newline at end of file
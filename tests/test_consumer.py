@@ -0,0 +1,67 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# config.py читает logging.json из текущего каталога
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+import main  # noqa: E402
+import retry  # noqa: E402
+from config import RETRY  # noqa: E402
+
+
+class Message:
+    def __init__(self, body: str):
+        self.body = body.encode('utf-8')
+        self.timestamp = None
+        self.settled = []
+
+    async def ack(self, multiple=False):
+        self.settled.append('ack')
+
+    async def nack(self, multiple=False, requeue=True):
+        self.settled.append('requeue' if requeue else 'nack')
+
+    async def reject(self, requeue=True):
+        self.settled.append('requeue' if requeue else 'reject')
+
+
+class RequeueTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.sleeps = []
+        patch = mock.patch.object(main.asyncio, 'sleep', self._sleep)
+        patch.start()
+        self.addCleanup(patch.stop)
+        main.acked()
+
+    async def _sleep(self, delay):
+        self.sleeps.append(delay)
+
+    async def test_malformed_message_is_rejected(self):
+        message = Message('not-a-pass')
+        await main.handle_message(message)
+        self.assertEqual(message.settled, ['reject'])
+        self.assertEqual(self.sleeps, [])
+
+    async def test_retryable_error_backs_off(self):
+        message = Message('БА 0000001')
+        with mock.patch.object(main, 'lookup', side_effect=retry.UpstreamError(503)):
+            for _ in range(3):
+                await main.handle_message(message)
+        self.assertEqual(message.settled, ['requeue'] * 3)
+        self.assertTrue(all(delay >= RETRY.min_requeue_delay for delay in self.sleeps))
+        self.assertEqual(main.REQUEUES, 3)
+
+    async def test_batch_rejects_only_malformed(self):
+        messages = [Message('БА 0000001'), Message('not-a-pass'), Message('БА 0000002')]
+        with mock.patch.object(main, 'lookup', return_value=None):
+            self.assertEqual(await main._process_batch(messages), 3)
+        self.assertEqual([message.settled for message in messages], [[], ['reject'], ['ack']])
+        self.assertEqual(self.sleeps, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import asyncio
+import os
+import random
+import sys
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# config.py читает logging.json из текущего каталога
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+import push_to_q  # noqa: E402
+
+# Сколько номеров выдано после последнего известного базе
+AHEAD = 1_500_000
+SEEDS = range(20)
+
+
+class IssuedNumbers:
+    """Номера до frontier выданы, кроме дыр с вероятностью holes; после frontier - ни одного."""
+
+    def __init__(self, seed: int, holes: float):
+        self.seed = seed
+        self.holes = holes
+        rng = random.Random(seed)
+        self.start = rng.randrange(1_000_000, 2_000_000)
+        self.frontier = self.start + AHEAD + rng.randrange(-AHEAD // 10, AHEAD // 10)
+
+    def issued(self, number: int) -> bool:
+        if number > self.frontier:
+            return False
+        if number == self.frontier:
+            return True
+        # Дыра или нет - одно и то же при любом порядке запросов
+        return random.Random(f'{self.seed}:{number}').random() >= self.holes
+
+    async def get_pass_info(self, pass_no: str, refresh: bool = False):
+        await asyncio.sleep(0)
+        return {'seriesAndNumber': pass_no} if self.issued(int(pass_no.split(' ')[1])) else None
+
+
+class FindFrontierTest(unittest.IsolatedAsyncioTestCase):
+    async def find(self, numbers: IssuedNumbers):
+        with mock.patch.object(push_to_q, 'ACCOUNTS', numbers), mock.patch('builtins.print'):
+            return await push_to_q.find_frontier(numbers.start)
+
+    async def check(self, holes: float):
+        for seed in SEEDS:
+            with self.subTest(seed=seed, holes=holes):
+                numbers = IssuedNumbers(seed, holes)
+                found, probes = await self.find(numbers)
+                self.assertEqual(found, numbers.frontier)
+                # O(log n): десятки окон, а не шаг за шагом
+                self.assertLess(probes, 1000)
+
+    async def test_without_holes(self):
+        await self.check(0.0)
+
+    async def test_20_percent_holes(self):
+        await self.check(0.2)
+
+    async def test_30_percent_holes(self):
+        await self.check(0.3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import asyncio
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from limiter import AdaptiveLimiter  # noqa: E402
+
+
+class AdaptiveLimiterTest(unittest.IsolatedAsyncioTestCase):
+    def limiter(self) -> AdaptiveLimiter:
+        return AdaptiveLimiter(initial=1, min_limit=1, max_limit=1, latency_target=1)
+
+    async def test_cancelled_waiter_passes_wake_up_on(self):
+        limiter = self.limiter()
+        started = await limiter.acquire()
+        first = asyncio.create_task(limiter.acquire())
+        second = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        # release будит первого, но его отменяют раньше, чем он займёт слот
+        limiter.release(started)
+        first.cancel()
+        await asyncio.wait_for(second, 1)
+        self.assertTrue(first.cancelled())
+        self.assertEqual(limiter.in_flight, 1)
+
+    async def test_cancelled_waiter_leaves_queue(self):
+        limiter = self.limiter()
+        started = await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        self.assertEqual(len(limiter._waiters), 0)
+        limiter.release(started)
+        self.assertEqual(limiter.in_flight, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
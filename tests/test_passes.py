@@ -0,0 +1,87 @@
+import asyncio
+import itertools
+import os
+import sys
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# config.py читает logging.json из текущего каталога
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+import config  # noqa: E402
+import negindex  # noqa: E402
+import passes  # noqa: E402
+import retry  # noqa: E402
+from accounts import Account, AccountPool, RateBudget  # noqa: E402
+
+_USERNAMES = itertools.count()
+
+
+class AccountPoolStatusTest(unittest.IsolatedAsyncioTestCase):
+    """Что AccountPool.get_pass_info делает с ответами API, кроме 200."""
+
+    def setUp(self):
+        self.status = 404
+        self.recorded = []
+        self.mospass = passes.MosPass(f'status-test-{next(_USERNAMES)}', 'secret', 'cookie')
+        self.mospass._send = self._send
+        patches = [
+            # Без повторов с паузами внутри retry.call
+            mock.patch.object(config.RETRY, 'upstream_attempts', 1),
+            mock.patch.object(negindex, 'record', lambda pass_no, found: self.recorded.append((pass_no, found))),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.pool = AccountPool()
+        self.pool.accounts.append(Account(self.mospass, RateBudget(0, 1)))
+
+    def tearDown(self):
+        for breaker in self.mospass.breakers.values():
+            retry._BREAKERS.pop(breaker.name, None)
+
+    async def _send(self, proxy, params, cookies):
+        await asyncio.sleep(0)
+        return self.status, None, None, None
+
+    async def test_404_is_missing(self):
+        self.assertIsNone(await self.pool.get_pass_info('БА 0000001'))
+        self.assertEqual(self.recorded, [('БА 0000001', False)])
+        self.assertEqual(self.pool.cache.stats()['size'], 1)
+
+    async def test_403_is_not_missing(self):
+        self.status = 403
+        with self.assertRaises(retry.UpstreamError) as raised:
+            await self.pool.get_pass_info('БА 0000001')
+        self.assertEqual(raised.exception.status, 403)
+        # Ни отметки в индексе несуществующих, ни записи в кэше
+        self.assertEqual(self.recorded, [])
+        self.assertEqual(self.pool.cache.stats()['size'], 0)
+
+    async def test_unexpected_status_is_not_missing(self):
+        for status in (302, 409):
+            self.status = status
+            with self.assertRaises(retry.UnexpectedStatus):
+                await self.pool.get_pass_info('БА 0000001')
+        self.assertEqual(self.recorded, [])
+        self.assertEqual(self.pool.cache.stats()['size'], 0)
+
+
+class DockerRunTest(unittest.IsolatedAsyncioTestCase):
+    async def test_logged_command_hides_env_values(self):
+        env = {'USERNAME': 'user', 'PASSWORD': 'secret', 'DSN': 'postgresql://app:dbsecret@db/passes'}
+        run = mock.AsyncMock(return_value='')
+        with mock.patch.object(passes, 'run_command_async', run), \
+                self.assertLogs(passes.LOGGER, 'DEBUG') as logged:
+            await passes.docker_run_async(config.AUTH_IMAGE, env)
+        output = '\n'.join(logged.output)
+        self.assertNotIn('secret', output)
+        self.assertIn("-e PASSWORD='***'", output)
+        # В docker уходят настоящие значения
+        self.assertIn("-e PASSWORD='secret'", run.call_args.args[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# config.py читает logging.json из текущего каталога
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+import config  # noqa: E402
+import proxies  # noqa: E402
+
+
+class ProxyTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patches = [
+            mock.patch.object(proxies.time, 'monotonic', lambda: self.now),
+            mock.patch.object(config.PROXY, 'min_samples', 10),
+            mock.patch.object(config.PROXY, 'min_health', 0.3),
+            mock.patch.object(config.PROXY, 'cooldown', 60),
+            mock.patch.object(config.PROXY, 'max_cooldown', 200),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.pool = proxies.ProxyPool()
+        for url in ('http://good:1', 'http://bad:1'):
+            self.pool.proxies[url] = proxies.Proxy(url)
+        self.good, self.bad = self.pool.proxies.values()
+
+    def ban(self, proxy, times=None):
+        for _ in range(times or config.PROXY.min_samples):
+            proxy.record(403, 0.1)
+
+    def test_bans_evict(self):
+        self.ban(self.bad, config.PROXY.min_samples - 1)
+        # До min_samples ответов прокси не выводится, как бы плохо ни шло
+        self.assertTrue(self.bad.admitted)
+        self.ban(self.bad, 1)
+        self.assertFalse(self.bad.admitted)
+        self.assertEqual(self.bad.evictions, 1)
+        self.assertEqual(self.bad.samples, 0)
+        for _ in range(20):
+            self.assertIs(self.pool.pick(), self.good)
+
+    def test_cooldown_doubles_up_to_max(self):
+        cooldowns = []
+        for _ in range(4):
+            self.bad.evict()
+            cooldowns.append(self.bad.evicted_until - self.now)
+        self.assertEqual(cooldowns, [60, 120, 200, 200])
+
+    def test_readmitted_after_cooldown(self):
+        self.ban(self.bad)
+        self.now += 59
+        self.assertFalse(self.bad.admitted)
+        self.now += 1
+        self.assertTrue(self.bad.admitted)
+        # Вернулся с чистой статистикой, но повторный вывод всё ещё дольше
+        self.assertEqual(self.bad.health, 1.0)
+        self.ban(self.bad)
+        self.assertEqual(self.bad.evicted_until - self.now, 120)
+
+    def test_probation_resets_evictions(self):
+        self.ban(self.bad)
+        self.now += 60
+        for _ in range(config.PROXY.min_samples):
+            self.bad.record(200, 0.1)
+        self.good.record(None, 0.1)  # теперь "плохой" здоровее
+        self.assertIs(self.pool.pick(), self.bad)
+        self.assertEqual(self.bad.evictions, 0)
+        self.ban(self.bad)
+        self.assertEqual(self.bad.evicted_until - self.now, 60)
+
+    def test_all_evicted(self):
+        self.ban(self.good)
+        self.ban(self.bad)
+        self.assertIsNone(self.pool.pick())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+import asyncio
+import itertools
+import os
+import sys
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# config.py читает logging.json из текущего каталога
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+import config  # noqa: E402
+import passes  # noqa: E402
+import retry  # noqa: E402
+
+CONCURRENCY = 16
+_USERNAMES = itertools.count()
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_opens_after_threshold(self):
+        breaker = retry.CircuitBreaker('test', failure_threshold=3, reset_timeout=30)
+        for _ in range(2):
+            breaker.record_failure()
+        self.assertFalse(breaker.is_open)
+        breaker.record_failure()
+        self.assertTrue(breaker.is_open)
+        with self.assertRaises(retry.CircuitOpenError) as raised:
+            breaker.allow()
+        self.assertGreater(raised.exception.retry_in, 0)
+
+    def test_half_open_trial_reports_remaining_window(self):
+        breaker = retry.CircuitBreaker('test', failure_threshold=1, reset_timeout=30)
+        breaker.record_failure()
+        breaker.opened_at -= 30
+        breaker.allow()  # пробный запрос
+        self.assertEqual(breaker.state, 'half_open')
+        self.assertTrue(breaker.is_open)
+        self.assertGreater(breaker.retry_in(), 29)
+        with self.assertRaises(retry.CircuitOpenError) as raised:
+            breaker.allow()
+        self.assertGreater(raised.exception.retry_in, 29)
+
+    def test_trial_success_closes(self):
+        breaker = retry.CircuitBreaker('test', failure_threshold=1, reset_timeout=30)
+        breaker.record_failure()
+        breaker.opened_at -= 30
+        breaker.allow()
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+        self.assertFalse(breaker.is_open)
+
+
+class RetryCallTest(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_renewed_401s_do_not_trip(self):
+        breaker = retry.CircuitBreaker('test', failure_threshold=5, reset_timeout=30)
+        attempts = {}
+
+        async def request(n):
+            attempts[n] = attempts.get(n, 0) + 1
+            await asyncio.sleep(0)
+            if attempts[n] == 1:
+                raise retry.Unauthorized('401', failure=False)
+            return n
+
+        results = await asyncio.gather(*[retry.call(request, n, breakers={'account': breaker})
+                                         for n in range(CONCURRENCY)])
+        self.assertEqual(results, list(range(CONCURRENCY)))
+        self.assertEqual(breaker.state, 'closed')
+        self.assertEqual(breaker.failures, 0)
+
+    async def test_401_failures_trip(self):
+        breaker = retry.CircuitBreaker('test', failure_threshold=5, reset_timeout=30)
+
+        async def request():
+            raise retry.Unauthorized('401')
+
+        results = await asyncio.gather(*[retry.call(request, breakers={'account': breaker})
+                                         for _ in range(CONCURRENCY)], return_exceptions=True)
+        self.assertTrue(all(isinstance(result, (retry.Unauthorized, retry.CircuitOpenError))
+                            for result in results))
+        self.assertEqual(breaker.state, 'open')
+
+
+class MosPassUnauthorizedTest(unittest.IsolatedAsyncioTestCase):
+    """N одновременных запросов получают 401 на одни и те же куки."""
+
+    def setUp(self):
+        self.issued = []
+        self.auths = 0
+        self.auth_ok = True
+        self.valid = set()
+        self.mospass = passes.MosPass(f'retry-test-{next(_USERNAMES)}', 'secret', self._issue())
+        self.mospass._send = self._send
+        patches = [
+            mock.patch.object(passes, 'docker_run_async', self._docker_run_async),
+            mock.patch.object(passes.db, 'get_account', self._get_account),
+            mock.patch.object(config.RETRY, 'failure_threshold', 5),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        retry._BREAKERS.pop(f'account:{self.mospass.username}', None)
+
+    def _issue(self) -> str:
+        cookie = f'cookie-{len(self.issued)}'
+        self.issued.append(cookie)
+        self.valid.add(cookie)
+        return cookie
+
+    async def _docker_run_async(self, image, env=None, **kwargs):
+        await asyncio.sleep(0.01)
+        self.auths += 1
+        if self.auth_ok:
+            self._issue()
+        return 0, '', ''
+
+    async def _get_account(self, username=None):
+        return [{'cookie_value': self.issued[-1]}]
+
+    async def _send(self, proxy, params, cookies):
+        await asyncio.sleep(0.001)
+        status = 404 if cookies['.AspNetCore.Cookies'] in self.valid else 401
+        return status, None, None, None
+
+    @property
+    def breaker(self) -> retry.CircuitBreaker:
+        return self.mospass.breakers['account']
+
+    async def lookup_all(self):
+        return await asyncio.gather(*[self.mospass.get_pass_info(f'БА {n:07d}') for n in range(CONCURRENCY)],
+                                    return_exceptions=True)
+
+    async def test_expired_cookie_reauths_once_without_tripping(self):
+        self.valid.clear()
+        results = await self.lookup_all()
+        self.assertEqual(results, [None] * CONCURRENCY)
+        self.assertEqual(len(self.issued), 2)  # одна авторизация на все запросы
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertEqual(self.breaker.failures, 0)
+
+    async def test_401_on_fresh_cookie_counts_once(self):
+        self.valid.clear()
+        # Авторизация выдаёт куки, которые API сразу не принимает
+        self.mospass._fresh_cookies = self.mospass.cookies
+        issue = self._issue
+
+        def rejected():
+            cookie = issue()
+            self.valid.discard(cookie)
+            return cookie
+        self._issue = rejected
+        await self.lookup_all()
+        self.assertLessEqual(self.breaker.failures, len(self.issued))
+        self.assertLess(self.breaker.failures, CONCURRENCY)
+
+    async def test_failed_auth_trips(self):
+        self.valid.clear()
+        self.auth_ok = False
+        results = await self.lookup_all()
+        self.assertTrue(all(isinstance(result, retry.Unauthorized) for result in results))
+        # Каждая неудачная авторизация - один сбой, а не по сбою на запрос в пути
+        self.assertEqual(self.breaker.failures, self.auths)
+        self.assertLess(self.auths, CONCURRENCY)
+        for _ in range(config.RETRY.failure_threshold):
+            if self.breaker.is_open:
+                break
+            await self.lookup_all()
+        self.assertEqual(self.breaker.state, 'open')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+"""
+Формат элементов очереди.
+
+Одиночный пропуск: "БА 1677805".
+Диапазон номеров одной серии (границы включительно): "БА 1677805..1678805".
+"""
+from typing import Iterator, NamedTuple
+
+RANGE_SEPARATOR = '..'
+NUMBER_WIDTH = 7
+
+
+class WorkItem(NamedTuple):
+    series: str
+    start: int
+    stop: int  # включительно
+
+    @property
+    def is_range(self) -> bool:
+        return self.stop != self.start
+
+    def __len__(self):
+        return self.stop - self.start + 1
+
+
+def format_pass(number: int, series: str) -> str:
+    return f'{series} {number:0{NUMBER_WIDTH}d}'
+
+
+def format_range(series: str, start: int, stop: int) -> str:
+    if start == stop:
+        return format_pass(start, series)
+    return f'{format_pass(start, series)}{RANGE_SEPARATOR}{stop:0{NUMBER_WIDTH}d}'
+
+
+def parse_item(body: str) -> WorkItem:
+    series, numbers = body.strip().split(' ', 1)
+    numbers = numbers.strip()
+    if RANGE_SEPARATOR in numbers:
+        start, stop = numbers.split(RANGE_SEPARATOR, 1)
+        start, stop = int(start), int(stop)
+    else:
+        start = stop = int(numbers)
+    if stop < start:
+        raise ValueError(f'Пустой диапазон: {body}')
+    return WorkItem(series, start, stop)
+
+
+def iter_passes(item: WorkItem, start: int | None = None) -> Iterator[str]:
+    """Номера диапазона по одному, без построения списка; start - с какого номера продолжить."""
+    for number in range(item.start if start is None else max(start, item.start), item.stop + 1):
+        yield format_pass(number, item.series)
+
+
+def split_range(series: str, start: int, stop: int, size: int) -> Iterator[str]:
+    """Разбивает [start, stop] на элементы очереди не длиннее size номеров."""
+    for chunk_start in range(start, stop + 1, size):
+        yield format_range(series, chunk_start, min(chunk_start + size - 1, stop))